@@ -0,0 +1,4 @@
+"""Stage level benchmarks of the photo pipeline on a synthetic image corpus.
+
+Run ``python -m benchmarks --help`` from the repository root.
+"""
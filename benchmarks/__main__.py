@@ -0,0 +1,108 @@
+"""Command line entry point: ``python -m benchmarks``.
+
+Needs the same ``config.py`` on the path as the bot. Geocoding is served from
+a primed cache so no request leaves the machine.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+# keep the benchmark away from the production geocoding cache
+os.environ.setdefault("FOTOBOT_GEOCODE_DB", os.path.join(tempfile.gettempdir(), "fotobot_bench_geocode.sqlite3"))
+
+from benchmarks.corpus import FORMATS, LATITUDE, LONGITUDE, MEGAPIXELS, generate_corpus  # noqa: E402
+
+
+def prime_geocode_cache() -> None:
+    from fotobot.exif.base import convert_to_degrees
+    from fotobot.exif.geocache import get_cache
+    get_cache().put(convert_to_degrees(LATITUDE), -convert_to_degrees(LONGITUDE), "Benchmark Address")
+
+
+def get_versions() -> dict:
+    import PIL
+    import pillow_heif
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "pillow_heif": pillow_heif.__version__,
+        "platform": platform.platform(),
+    }
+
+
+def run(args) -> dict:
+    from benchmarks.stages import exiftool_available, run_stages
+
+    items = generate_corpus(args.corpus, args.formats, args.megapixels)
+    prime_geocode_cache()
+    with_exiftool = not args.no_exiftool and exiftool_available()
+
+    results = []
+    for item in items:
+        print(f"{os.path.basename(item.path)}...", file=sys.stderr)
+        stages = run_stages(item.path, args.style, args.repeat, with_exiftool, args.resize_mode)
+        results.append({**item._asdict(), "stages": stages})
+
+    return {
+        "meta": {
+            **get_versions(),
+            "timestamp": time.time(),
+            "repeat": args.repeat,
+            "style": args.style,
+            "resize_mode": args.resize_mode,
+            "exiftool": with_exiftool,
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """Return (file, stage, old p50, new p50) for stages slower than ``threshold``x."""
+    old = {(os.path.basename(r["path"]), stage): timing["p50_ms"]
+           for r in baseline["results"] for stage, timing in r["stages"].items()}
+    regressions = []
+    for r in current["results"]:
+        for stage, timing in r["stages"].items():
+            key = (os.path.basename(r["path"]), stage)
+            if key in old and timing["p50_ms"] > old[key] * threshold:
+                regressions.append((*key, old[key], timing["p50_ms"]))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "fotobot_corpus"),
+                        help="directory of the generated corpus, reused between runs")
+    parser.add_argument("--formats", nargs="+", default=list(FORMATS), choices=FORMATS)
+    parser.add_argument("--megapixels", nargs="+", type=int, default=list(MEGAPIXELS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--style", type=int, default=1, choices=(1, 2, 3))
+    parser.add_argument("--resize-mode", default="quality", choices=("quality", "speed"))
+    parser.add_argument("--no-exiftool", action="store_true")
+    parser.add_argument("--out", default="bench.json", help="where to write the JSON results")
+    parser.add_argument("--compare", help="earlier JSON results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=1.10,
+                        help="p50 ratio above which a stage counts as a regression")
+    args = parser.parse_args()
+
+    report = run(args)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        for name, stage, old, new in regressions:
+            print(f"REGRESSION {name} {stage}: {old:.2f}ms -> {new:.2f}ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
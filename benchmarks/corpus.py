@@ -0,0 +1,135 @@
+"""Deterministic synthetic image corpus for the benchmarks."""
+
+import math
+import os
+import struct
+from typing import NamedTuple
+
+from PIL import Image, ExifTags
+
+FORMATS = ("jpeg", "png", "heic", "avif")
+MEGAPIXELS = (2, 12, 24, 45)
+ORIENTATIONS = (1, 3, 6, 8)
+
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "heic": "heic", "avif": "avif"}
+PIL_FORMATS = {"jpeg": "JPEG", "png": "PNG", "heic": "HEIF", "avif": "AVIF"}
+
+# coordinates written into the "full" variant
+LATITUDE = (45.0, 30.0, 18.0)
+LONGITUDE = (73.0, 34.0, 12.0)
+
+
+class CorpusItem(NamedTuple):
+    path: str
+    format: str
+    megapixels: int
+    variant: str
+    orientation: int
+
+
+def get_size(megapixels: int) -> (int, int):
+    """3:2 landscape dimensions with roughly ``megapixels`` million pixels."""
+    width = int(math.sqrt(megapixels * 1e6 * 3 / 2))
+    return width, width * 2 // 3
+
+
+def make_pixels(size: (int, int)) -> Image.Image:
+    """Smooth gradients with some structure, identical on every run."""
+    w, h = size
+    red = Image.linear_gradient("L").resize(size)
+    green = Image.linear_gradient("L").rotate(90).resize(size)
+    blue = Image.radial_gradient("L").resize(size)
+    img = Image.merge("RGB", (red, green, blue))
+    # a faint checker pattern so the encoders have edges to work on
+    cols, rows = 48, 32
+    checker = Image.new("L", (cols, rows))
+    checker.putdata([(x + y) % 2 * 64 for y in range(rows) for x in range(cols)])
+    img.paste(Image.new("RGB", size, "white"), mask=checker.resize(size, Image.Resampling.NEAREST))
+    return img
+
+
+def make_exif(variant: str, orientation: int) -> Image.Exif:
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "NIKON CORPORATION"
+    exif[ExifTags.Base.Model] = "NIKON Z 8"
+    exif[ExifTags.Base.Orientation] = orientation
+    exif[ExifTags.Base.ExifOffset] = {
+        ExifTags.Base.LensMake: "Nikon",
+        ExifTags.Base.LensModel: "NIKKOR Z 50mm f/1.8 S",
+        ExifTags.Base.FocalLength: 50.0,
+        ExifTags.Base.FocalLengthIn35mmFilm: 50,
+        ExifTags.Base.FNumber: 2.8,
+        ExifTags.Base.ExposureTime: 0.004,
+        ExifTags.Base.ISOSpeedRatings: 64,
+        ExifTags.Base.ExposureBiasValue: -0.67,
+        ExifTags.Base.MeteringMode: 5,
+        ExifTags.Base.DateTimeOriginal: "2023:07:19 12:18:02",
+    }
+    if variant == "full":
+        exif[ExifTags.Base.Artist] = "Benchmark"
+        exif[ExifTags.Base.GPSInfo] = {
+            ExifTags.GPS.GPSLatitudeRef: "N",
+            ExifTags.GPS.GPSLatitude: LATITUDE,
+            ExifTags.GPS.GPSLongitudeRef: "W",
+            ExifTags.GPS.GPSLongitude: LONGITUDE,
+        }
+    return exif
+
+
+def make_iptc_segment() -> bytes:
+    """APP13 Photoshop segment holding a few IPTC IIM datasets."""
+    records = b""
+    for dataset, value in ((5, "Benchmark title"), (25, "synthetic"), (90, "Montreal"),
+                           (95, "Quebec"), (100, "CAN"), (101, "Canada")):
+        data = value.encode()
+        records += struct.pack(">BBBH", 0x1C, 2, dataset, len(data)) + data
+    if len(records) % 2:
+        records += b"\0"
+    resource = b"8BIM" + struct.pack(">H", 0x0404) + b"\0\0" + struct.pack(">I", len(records)) + records
+    payload = b"Photoshop 3.0\0" + resource
+    return b"\xff\xed" + struct.pack(">H", len(payload) + 2) + payload
+
+
+def insert_jpeg_segment(path: str, segment: bytes) -> None:
+    """Insert ``segment`` right after the SOI marker of the JPEG at ``path``."""
+    with open(path, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data[:2] + segment + data[2:])
+
+
+def get_variants():
+    yield "bare", 1
+    for orientation in ORIENTATIONS:
+        yield "exif", orientation
+    yield "full", 1
+
+
+def generate_corpus(out_dir: str, formats=FORMATS, megapixels=MEGAPIXELS) -> list:
+    """Write the corpus to ``out_dir`` (reusing existing files) and describe it."""
+    os.makedirs(out_dir, exist_ok=True)
+    if "heic" in formats:
+        from pillow_heif import register_heif_opener
+        register_heif_opener()
+    if "avif" in formats:
+        import pillow_avif  # noqa: F401
+
+    items = []
+    for mp in megapixels:
+        pixels = None
+        for fmt in formats:
+            for variant, orientation in get_variants():
+                name = f"{mp}mp_{variant}_o{orientation}.{EXTENSIONS[fmt]}"
+                path = os.path.join(out_dir, name)
+                items.append(CorpusItem(path, fmt, mp, variant, orientation))
+                if os.path.exists(path):
+                    continue
+                if pixels is None:
+                    pixels = make_pixels(get_size(mp))
+                params = {}
+                if variant != "bare":
+                    params["exif"] = make_exif(variant, orientation).tobytes()
+                pixels.save(path, PIL_FORMATS[fmt], **params)
+                if fmt == "jpeg" and variant == "full":
+                    insert_jpeg_segment(path, make_iptc_segment())
+    return items
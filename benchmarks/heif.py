@@ -0,0 +1,101 @@
+"""Compare HEIF/AVIF handling before and after registering the plugins once.
+
+``python -m benchmarks.heif`` times reading metadata and decoding plus
+resizing every HEIC and AVIF file of the corpus two ways:
+
+* ``per_request``: the plugin is registered on every request with
+  pillow-heif's default options, as ``check_mime`` used to do;
+* ``registered_once``: :func:`fotobot.exif.heif.register_plugins` at startup.
+
+The synthetic corpus has no depth maps or thumbnails, real iPhone photos
+gain more from skipping them than these numbers show.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+from benchmarks.corpus import MEGAPIXELS, generate_corpus
+from benchmarks.stages import measure
+
+FORMATS = ("heic", "avif")
+
+
+def register_per_request() -> None:
+    from pillow_heif import register_heif_opener
+    from pillow_avif import AvifImagePlugin
+    register_heif_opener(thumbnails=True, depth_images=True)
+    AvifImagePlugin.CHROMA_UPSAMPLING = "auto"
+
+
+def register_once() -> None:
+    from fotobot.exif import heif
+    heif.register_plugins()
+
+
+def reset_registration() -> None:
+    from fotobot.exif import heif
+    heif._registered = False
+
+
+def run_paths(path: str, repeat: int, resize_mode: str) -> dict:
+    from PIL import Image
+    from fotobot.exif.base import read_metadata
+    from fotobot.services.processing import img_resize
+
+    def read(register):
+        register()
+        with Image.open(path) as img:
+            return read_metadata(img)
+
+    def decode(register):
+        register()
+        return img_resize(path, 1, resize_mode)
+
+    stages = {}
+    # register_per_request restores pillow-heif's defaults, so register_once
+    # must apply its options again
+    stages["per_request_metadata"], _ = measure(lambda: read(register_per_request), repeat)
+    stages["per_request_decode"], _ = measure(lambda: decode(register_per_request), repeat)
+    reset_registration()
+    stages["registered_once_metadata"], _ = measure(lambda: read(register_once), repeat)
+    stages["registered_once_decode"], _ = measure(lambda: decode(register_once), repeat)
+    return stages
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.heif", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "fotobot_corpus"))
+    parser.add_argument("--megapixels", nargs="+", type=int, default=list(MEGAPIXELS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--resize-mode", default="quality", choices=("quality", "speed"))
+    parser.add_argument("--out", default="bench_heif.json", help="where to write the JSON results")
+    args = parser.parse_args()
+
+    import pillow_heif
+    items = [item for item in generate_corpus(args.corpus, FORMATS, args.megapixels)
+             if item.variant != "exif" or item.orientation == 1]
+    results = []
+    for item in items:
+        print(f"{os.path.basename(item.path)}...", file=sys.stderr)
+        stages = run_paths(item.path, args.repeat, args.resize_mode)
+        results.append({**item._asdict(), "stages": stages})
+        line = ", ".join(f"{stage} {timing['p50_ms']:.1f}ms" for stage, timing in stages.items())
+        print(f"  {line}", file=sys.stderr)
+
+    report = {
+        "meta": {"pillow_heif": pillow_heif.__version__, "repeat": args.repeat,
+                 "resize_mode": args.resize_mode},
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
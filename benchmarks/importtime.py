@@ -0,0 +1,69 @@
+"""Check the import cost of the photo pipeline: ``python -m benchmarks.importtime``.
+
+Every module is imported in a fresh interpreter under ``python -X importtime``.
+The check fails when the cumulative import time is above the budget, or when a
+heavy dependency that should only load on first use was imported.
+"""
+
+import argparse
+import subprocess
+import sys
+
+# modules that must stay cheap to import, they don't need config.py
+MODULES = ("fotobot.exif", "fotobot.services.processing", "fotobot.batch")
+# loaded by the first photo that needs them, never at import time
+LAZY = ("geopy", "aiohttp", "exiftool", "magic", "pillow_heif", "pillow_avif",
+        "fotobot.exif.exiftoolworker", "fotobot.exif.pillowworker")
+BUDGET_MS = 150.0
+
+
+def import_times(module: str) -> dict:
+    """Return the cumulative import time in ms of every module ``module`` loads."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            times[name.strip()] = int(cumulative) / 1000
+        except ValueError:
+            # the header line
+            continue
+    return times
+
+
+def check(module: str, budget_ms: float, repeat: int) -> list:
+    """Return the problems found importing ``module``, the best of ``repeat`` runs counts."""
+    runs = [import_times(module) for _ in range(repeat)]
+    best = min(times[module] for times in runs)
+    problems = []
+    if best > budget_ms:
+        problems.append(f"{module}: {best:.1f}ms over the {budget_ms:.0f}ms budget")
+    loaded = sorted(name for name in LAZY if name in runs[0])
+    if loaded:
+        problems.append(f"{module}: imports {', '.join(loaded)} eagerly")
+    print(f"{module}: {best:.1f}ms", file=sys.stderr)
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.importtime", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=list(MODULES))
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS,
+                        help="cumulative import time allowed per module")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    problems = []
+    for module in args.modules:
+        problems.extend(check(module, args.budget_ms, args.repeat))
+    for problem in problems:
+        print(f"FAIL {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
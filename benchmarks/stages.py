@@ -0,0 +1,72 @@
+"""Time each stage of the photo pipeline separately on one corpus item."""
+
+import math
+import resource
+import statistics
+import time
+
+from fotobot.exif.base import get_worker, load_metadata
+from fotobot.exif.exiftoolpool import get_pool
+from fotobot.services import processing
+
+
+def summarize(samples: list) -> dict:
+    """p50/p95/mean in milliseconds plus the process peak RSS so far."""
+    ordered = sorted(samples)
+    p95_index = max(math.ceil(0.95 * len(ordered)) - 1, 0)
+    return {
+        "p50_ms": statistics.median(ordered) * 1000,
+        "p95_ms": ordered[p95_index] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def measure(func, repeat: int):
+    """Call ``func`` ``repeat`` times, return its timings and last result."""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples), result
+
+
+def exiftool_available() -> bool:
+    try:
+        get_pool().start()
+        return True
+    except Exception:
+        return False
+
+
+def run_stages(path: str, style: int, repeat: int, with_exiftool: bool,
+               resize_mode: str = processing.RESIZE_MODE) -> dict:
+    """Return the timings of every stage for the image at ``path``.
+
+    Only ``get_mime`` is timed for files the bot would reject.
+    """
+    stages = {}
+    stages["get_mime"], mimetype = measure(lambda: processing.get_mime(path), repeat)
+    try:
+        processing.check_mime(mimetype)
+    except processing.UnsupportedFormatError:
+        return stages
+    stages["load_metadata"], _ = measure(lambda: load_metadata(path), repeat)
+    stages["pillow_worker"], worker = measure(lambda: get_worker("pillow", path), repeat)
+    if with_exiftool:
+        stages["exiftool_worker"], _ = measure(lambda: get_worker("exiftool", path), repeat)
+
+    def build_metadata():
+        worker._metadata = None
+        return worker.get_metadata()
+
+    stages["get_metadata"], metadata = measure(build_metadata, repeat)
+    stages["get_template"], template = measure(lambda: processing.get_template(metadata, style), repeat)
+    stages["get_description"], _ = measure(lambda: processing.get_description(metadata, template), repeat)
+    stages["img_resize"], img = measure(
+        lambda: processing.img_resize(path, metadata.orientation, resize_mode), repeat
+    )
+    stages["img_to_bytes"], _ = measure(lambda: processing.img_to_bytes(img), repeat)
+    return stages
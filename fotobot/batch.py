@@ -0,0 +1,182 @@
+"""Caption a whole directory of photos offline: ``python -m fotobot.batch``.
+
+Every file is run through the same detection, worker registry and caption
+templates as the bot, spread over a process pool with one persistent
+exiftool per process. Geocoding requests of all processes share one rate
+limit. One JSON object per file is appended to the output, so an
+interrupted run can be resumed with ``--resume``.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+
+from fotobot.exif.geocache import RateLimiter
+from fotobot.exif.source import as_source
+from fotobot.exif.styles import Style
+from fotobot.services import processing
+from fotobot.services.executor import init_worker
+from fotobot.services.preview_cache import PreviewCache, set_preview_cache
+
+EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".avif")
+# seconds between two progress lines
+REPORT_EVERY = 5.0
+
+logger = logging.getLogger("fotobot.batch")
+
+
+def find_photos(root: str, extensions=EXTENSIONS) -> list:
+    """Sorted paths of every file below ``root`` with one of ``extensions``."""
+    photos = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(extensions):
+                photos.append(os.path.join(dirpath, filename))
+    return photos
+
+
+def read_done(out_path: str) -> set:
+    """Paths already processed successfully according to an earlier output."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line of a killed run may be cut short
+                continue
+            if record.get("status") == "ok":
+                done.add(record["path"])
+    return done
+
+
+def end_line(out_path: str) -> None:
+    """Terminate a last line cut short, so appended records start on a line of their own."""
+    if not os.path.exists(out_path) or not os.path.getsize(out_path):
+        return
+    with open(out_path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def get_preview_path(path: str, root: str, preview_dir: str) -> str:
+    relative = os.path.relpath(path, root)
+    # keep the original extension so photo.heic and photo.jpg don't collide
+    if not relative.lower().endswith((".jpg", ".jpeg")):
+        relative += ".jpg"
+    return os.path.join(preview_dir, relative)
+
+
+def init_batch_worker(preview_cache_dir=None, geocode_limiter=None) -> None:
+    # per-file warnings of the workers would drown the progress report,
+    # failures end up in the output anyway
+    logging.getLogger().setLevel(logging.ERROR)
+    # never the bot's cache, a batch run would fill it with previews nobody asks for
+    set_preview_cache(PreviewCache(preview_cache_dir) if preview_cache_dir else None)
+    init_worker(geocode_limiter=geocode_limiter)
+
+
+def caption_file(task) -> dict:
+    """Detect, parse, caption and optionally render one photo. Runs in a pool process."""
+    path, style, root, preview_dir = task
+    started = time.perf_counter()
+    record = {"path": path}
+    try:
+        # opened once, the parse and the decode for the preview share it
+        with as_source(path) as source:
+            mimetype = processing.get_mime(source)
+            processing.check_mime(mimetype)
+            worker = processing.get_worker(source)
+            metadata = worker.get_metadata()
+            caption = processing.get_description(metadata, processing.get_template(metadata, style))
+            record.update(
+                status="ok",
+                mimetype=mimetype,
+                backend=worker.worker_name,
+                caption=caption,
+                coordinates=processing.get_coordinates(metadata),
+                metadata=metadata._asdict(),
+            )
+            if preview_dir is not None:
+                photo = processing.render_photo(source, caption, processing.get_orientation(metadata))
+                if photo is not None:
+                    preview_path = get_preview_path(path, root, preview_dir)
+                    os.makedirs(os.path.dirname(preview_path), exist_ok=True)
+                    with open(preview_path, "wb") as f:
+                        f.write(photo)
+                    record["preview"] = preview_path
+    except processing.UnsupportedFormatError as e:
+        record.update(status="error", error=f"{e.args[0] if e.args else 'Unknown'} not supported")
+    except Exception as e:
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    record["seconds"] = time.perf_counter() - started
+    return record
+
+
+def run(args) -> int:
+    """Process every photo below ``args.root``, return the number of failures."""
+    style = Style[args.style.upper()].value
+    photos = find_photos(args.root)
+    done = read_done(args.out) if args.resume else set()
+    todo = [path for path in photos if path not in done]
+    logger.info("%s photos found, %s already done, %s to go", len(photos), len(done), len(todo))
+
+    if args.resume:
+        end_line(args.out)
+    tasks = [(path, style, args.root, args.previews) for path in todo]
+    failures = 0
+    started = last_report = time.monotonic()
+    with open(args.out, "a" if args.resume else "w") as out, \
+            multiprocessing.Pool(args.workers or None, initializer=init_batch_worker,
+                                 initargs=(args.preview_cache, RateLimiter())) as pool:
+        for count, record in enumerate(pool.imap_unordered(caption_file, tasks, args.chunksize), 1):
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            # flushed per line so --resume loses at most the files in flight
+            out.flush()
+            if record["status"] != "ok":
+                failures += 1
+                logger.warning("%s: %s", record["path"], record["error"])
+            now = time.monotonic()
+            if now - last_report >= REPORT_EVERY or count == len(tasks):
+                rate = count / (now - started)
+                eta = (len(tasks) - count) / rate if rate else 0
+                logger.info("%s/%s done, %.1f photos/s, %s failed, ETA %.0fs",
+                             count, len(tasks), rate, failures, eta)
+                last_report = now
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m fotobot.batch", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("root", help="directory searched recursively for photos")
+    parser.add_argument("--out", default="captions.jsonl", help="JSON lines output file")
+    parser.add_argument("--style", default="default", choices=[s.name.lower() for s in Style])
+    parser.add_argument("--previews", metavar="DIR",
+                        help="also write the resized previews to DIR, mirroring the input tree")
+    parser.add_argument("--preview-cache", metavar="DIR",
+                        help="cache rendered previews in DIR across runs, off by default")
+    parser.add_argument("--workers", type=int, default=0, help="pool processes, 0 for one per CPU")
+    parser.add_argument("--chunksize", type=int, default=4, help="photos handed to a process at once")
+    parser.add_argument("--resume", action="store_true",
+                        help="append to --out and skip photos it already lists as done")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.WARNING,
+    )
+    logger.setLevel(logging.INFO)
+    return 1 if run(args) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
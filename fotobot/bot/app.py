@@ -1,4 +1,5 @@
 import logging
+import os
 import textwrap
 from telegram import (
     Update,
@@ -14,7 +15,12 @@ from telegram.ext import (
     MessageHandler
 )
 from telegram import __version__ as TG_VER
-from fotobot.services.helper import escape
+from fotobot import metrics
+from fotobot.bot.persistence import create_persistence
+from fotobot.bot.update_processor import ChatOrderedUpdateProcessor
+from fotobot.services.executor import shutdown_executor
+from fotobot.services.helper import escape, reply_text
+from fotobot.services.outbox import get_outbox, shutdown_outbox
 from fotobot.services.photo_handler import photo_handler
 
 try:
@@ -37,6 +43,9 @@ logging.basicConfig(
 
 STYLE, DEFAULT, FULL, PRETTY = range(4)
 
+# Number of chats handled in parallel, 1 keeps the strictly sequential behaviour
+CONCURRENT_UPDATES = int(os.getenv("FOTOBOT_CONCURRENT_UPDATES", "1"))
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Send a message when the command /start is issued."""
 
@@ -78,21 +87,23 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         escape(textwrap.dedent(style_pretty))
     ]]
 
-    await update.message.reply_text(
+    await reply_text(
+        update,
         escape("Pick an output format you want to use :)"),
+        constants.ParseMode.HTML,
         reply_markup=ReplyKeyboardMarkup(
             reply_keyboard, one_time_keyboard=True, input_field_placeholder="Which format?"
-        ),
-        parse_mode=constants.ParseMode.HTML
+        )
     )
     return STYLE
 
 async def style(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     style = update.message.text[:8].strip()
-    await update.message.reply_text(
+    await reply_text(
+        update,
         "I see! Please send me a photo of <code>.jpg/.png/.heif/.avif</code> as file",
-        reply_markup=ReplyKeyboardRemove(),
-        parse_mode=constants.ParseMode.HTML
+        constants.ParseMode.HTML,
+        reply_markup=ReplyKeyboardRemove()
     )
     if style == 'Default':
         return DEFAULT
@@ -116,14 +127,48 @@ async def pretty(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return PRETTY
 
 
-def build_app(token: str) -> Application:
-    application = (
+def collect_runtime_stats() -> list:
+    outbox = get_outbox().stats()
+    return [
+        ("fotobot_outbox_queued", "gauge", "Replies waiting in the outbound queue",
+         [({"priority": key}, value) for key, value in outbox["queued"].items()]),
+        ("fotobot_outbox_in_flight", "gauge", "Replies being sent right now",
+         [({}, outbox["in_flight"])]),
+        ("fotobot_outbox_sent_total", "counter", "Replies sent through the outbound queue",
+         [({"priority": key}, value) for key, value in outbox["sent"].items()]),
+        ("fotobot_outbox_wait_seconds_total", "counter", "Time replies spent queued",
+         [({"priority": key}, value) for key, value in outbox["wait_seconds"].items()]),
+    ]
+
+
+async def post_init(application: Application) -> None:
+    metrics.register_collector(collect_runtime_stats)
+    application.bot_data["metrics_runner"] = await metrics.start_metrics_server()
+
+
+async def post_shutdown(application: Application) -> None:
+    runner = application.bot_data.get("metrics_runner")
+    if runner is not None:
+        await runner.cleanup()
+    await shutdown_outbox()
+    shutdown_executor()
+
+
+def build_app(token: str, concurrent_updates: int = CONCURRENT_UPDATES) -> Application:
+    builder = (
         Application.builder()
         .token(token)
         .read_timeout(30)
         .write_timeout(30)
-        .build()
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
     )
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(ChatOrderedUpdateProcessor(concurrent_updates))
+    persistence = create_persistence()
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    application = builder.build()
 
     conv_handler = ConversationHandler(
         entry_points=[MessageHandler(filters.ALL, start)],
@@ -134,6 +179,9 @@ def build_app(token: str) -> Application:
             PRETTY: [MessageHandler(filters.Document.IMAGE, pretty)],
         },
         fallbacks=[MessageHandler(filters.TEXT, start)],
+        # keep each chat's style across restarts
+        name="style",
+        persistent=persistence is not None,
     )
     application.add_handler(conv_handler)
     return application
@@ -0,0 +1,169 @@
+"""Conversation states kept across restarts in SQLite."""
+
+import asyncio
+import logging
+import os
+import sqlite3
+import struct
+import threading
+import time
+from typing import Dict, Optional
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# empty disables persistence, every chat starts over at /start after a restart
+STATE_DB = os.getenv("FOTOBOT_STATE_DB", "conversation_state.sqlite3")
+# seconds between two runs handing the changed states to the persistence
+UPDATE_INTERVAL = float(os.getenv("FOTOBOT_STATE_INTERVAL", "10"))
+
+
+# conversation keys are tuples of chat, user and message ids, stored as packed
+# 64 bit integers: decoding them is what dominates loading millions of chats
+_key_structs = {}
+
+
+def get_key_struct(length: int) -> struct.Struct:
+    key_struct = _key_structs.get(length)
+    if key_struct is None:
+        key_struct = _key_structs[length] = struct.Struct(f"<{length}q")
+    return key_struct
+
+
+def encode_key(key: tuple) -> bytes:
+    return get_key_struct(len(key)).pack(*key)
+
+
+def decode_key(key: bytes) -> tuple:
+    return get_key_struct(len(key) // 8).unpack(key)
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores the states of the ``ConversationHandler`` and nothing else.
+
+    Changes are buffered and written behind in one transaction from a thread,
+    so no update waits for the disk. The handler's own dict serves all reads
+    once :meth:`get_conversations` loaded it at startup. The database is in
+    WAL mode, a crash loses at most the changes of the last update interval.
+    """
+
+    def __init__(self, path: str = STATE_DB, update_interval: float = UPDATE_INTERVAL) -> None:
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval,
+        )
+        # (name, key) -> new state, None to delete, not written yet
+        self._pending = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "name TEXT, key BLOB, state, PRIMARY KEY (name, key)) WITHOUT ROWID"
+        )
+        self._db.commit()
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        started = time.perf_counter()
+        # millions of rows take seconds, the loop keeps serving meanwhile
+        conversations = await asyncio.to_thread(self._read, name)
+        for (pending_name, key), state in self._pending.items():
+            if pending_name != name:
+                continue
+            if state is None:
+                conversations.pop(key, None)
+            else:
+                conversations[key] = state
+        logging.info("Loaded %s %s conversations in %.3fs",
+                     len(conversations), name, time.perf_counter() - started)
+        return conversations
+
+    def _read(self, name: str) -> Dict[tuple, object]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, state FROM conversations WHERE name = ?", (name,)
+            ).fetchall()
+        return {decode_key(key): state for key, state in rows}
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        self._pending[(name, key)] = new_state
+        if self._flush_task is None or self._flush_task.done():
+            # starts once the application handed over the whole batch
+            self._flush_task = asyncio.create_task(self._flush_pending())
+
+    async def _flush_pending(self) -> None:
+        while self._pending:
+            pending, self._pending = self._pending, {}
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except sqlite3.Error as e:
+                logging.error("Cannot write conversation states: %s", e)
+                # retried with the next change, newer states win
+                self._pending = {**pending, **self._pending}
+                return
+
+    def _write(self, pending: dict) -> None:
+        started = time.perf_counter()
+        updates = [(name, encode_key(key), state) for (name, key), state in pending.items() if state is not None]
+        deletes = [(name, encode_key(key)) for (name, key), state in pending.items() if state is None]
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)", updates
+            )
+            self._db.executemany("DELETE FROM conversations WHERE name = ? AND key = ?", deletes)
+        logging.debug("Wrote %s conversation states in %.3fs", len(pending), time.perf_counter() - started)
+
+    async def flush(self) -> None:
+        """Write what is left and close the database, called on shutdown."""
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._flush_pending()
+        with self._lock:
+            self._db.close()
+
+    # only conversations are stored, see store_data
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        pass
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self, user_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
+
+
+def create_persistence() -> Optional[SQLitePersistence]:
+    """The persistence configured by ``FOTOBOT_STATE_DB``, ``None`` when disabled."""
+    return SQLitePersistence() if STATE_DB else None
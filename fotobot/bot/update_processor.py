@@ -0,0 +1,65 @@
+"""Update processor that runs chats in parallel while keeping each chat in order."""
+
+import asyncio
+from typing import Any, Awaitable
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Process updates of different chats concurrently, one at a time per chat.
+
+    The ``ConversationHandler`` keeps one state per chat/user, so updates of a
+    single chat must not overtake each other. Updates waiting for their chat do
+    not hold one of the ``max_concurrent_updates`` slots, so a busy chat (e.g. an
+    album upload) cannot starve the others. ``max_pending_updates`` bounds the
+    total number of accepted updates including the waiting ones.
+    """
+
+    __slots__ = ("_active_limit", "_active", "_chats")
+
+    def __init__(self, max_concurrent_updates: int, max_pending_updates: int = 0):
+        # set before super().__init__, which validates through the property
+        self._active_limit = max_concurrent_updates
+        super().__init__(max_concurrent_updates)
+        # the base class sized its semaphore from the property, it bounds the
+        # accepted updates here and must leave room for those waiting on a chat
+        self._semaphore = asyncio.BoundedSemaphore(max(max_pending_updates, max_concurrent_updates * 16))
+        self._active = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat id -> [lock, number of updates holding or waiting for it]
+        self._chats = {}
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self._active_limit
+
+    @staticmethod
+    def get_chat_id(update: object):
+        if isinstance(update, Update) and update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: "Awaitable[Any]") -> None:
+        chat_id = self.get_chat_id(update)
+        if chat_id is None:
+            async with self._active:
+                await coroutine
+            return
+
+        entry = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._active:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chats[chat_id]
+
+    async def initialize(self) -> None:
+        """Nothing to allocate."""
+
+    async def shutdown(self) -> None:
+        """Nothing to free."""
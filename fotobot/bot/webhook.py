@@ -0,0 +1,92 @@
+"""Webhook server that feeds Telegram updates into the application."""
+
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+# Telegram never sends updates close to this, it only guards against abuse
+MAX_BODY_SIZE = 1024 * 1024
+
+
+def build_webhook_app(application: Application, path: str = "/",
+                      secret_token: str = None) -> web.Application:
+    """Return an aiohttp app that queues updates POSTed to ``path``.
+
+    Requests are acknowledged as soon as the update is queued; the handlers run
+    in the application's own update loop.
+    """
+    async def receive_update(request: web.Request) -> web.Response:
+        if secret_token is not None:
+            received = request.headers.get(SECRET_TOKEN_HEADER, "")
+            if not hmac.compare_digest(received.encode(), secret_token.encode()):
+                logging.warning("Rejected webhook request with invalid secret token")
+                return web.Response(status=403)
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise TypeError(f"expected an object, got {type(data).__name__}")
+            update = Update.de_json(data, application.bot)
+        except (json.JSONDecodeError, TypeError, KeyError) as e:
+            logging.error(f"Cannot parse webhook update: {e}")
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    web_app = web.Application(client_max_size=MAX_BODY_SIZE)
+    web_app.router.add_post(path, receive_update)
+    return web_app
+
+
+async def run_webhook(application: Application, url: str, listen: str = "0.0.0.0",
+                      port: int = 8443, secret_token: str = None,
+                      max_connections: int = 40) -> None:
+    """Serve ``application`` through a webhook at the public ``url`` until stopped.
+
+    ``max_connections`` is passed to ``setWebhook`` and caps the number of
+    simultaneous connections Telegram opens to the server.
+    """
+    path = urlparse(url).path or "/"
+    runner = web.AppRunner(build_webhook_app(application, path, secret_token))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+    except NotImplementedError:
+        # Windows, Ctrl+C cancels the wait below and the finally block still cleans up
+        logging.debug("Signal handlers not supported, relying on KeyboardInterrupt")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        await application.bot.set_webhook(
+            url=url,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES,
+            secret_token=secret_token,
+        )
+        logging.info("Webhook listening on %s:%s%s", listen, port, path)
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
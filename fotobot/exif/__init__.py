@@ -1,9 +1,11 @@
 """Exif worker package."""
 
-# Import workers so that they register themselves when this package is imported
-from . import exiftoolworker  # noqa: F401
-from . import pillowworker  # noqa: F401
+from .base import get_worker, load_worker, register_lazy_worker, register_worker
+from .metadata import PhotoMetadata
 
-from .base import get_worker, register_worker
+# Workers are imported on first use, the exiftool backend and geocoding are
+# too heavy to load at startup
+register_lazy_worker("pillow", "fotobot.exif.pillowworker:PillowWorker")
+register_lazy_worker("exiftool", "fotobot.exif.exiftoolworker:ExifToolWorker")
 
-__all__ = ["get_worker", "register_worker"]
+__all__ = ["get_worker", "load_worker", "register_lazy_worker", "register_worker", "PhotoMetadata"]
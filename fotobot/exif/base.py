@@ -1,22 +1,50 @@
+import importlib
+from collections import OrderedDict
+
 from PIL import Image, ExifTags, IptcImagePlugin
 
-# registry for Exif workers
+from fotobot import metrics
+from fotobot.exif.source import PhotoSource
+
+# registry for Exif workers, values are either the worker class or a
+# "module:Class" string imported the first time the worker is asked for
 WORKER_REGISTRY = {}
 
+RECENTLY_PARSED_SIZE = 256
+_recently_parsed = OrderedDict()
+
 
 def register_worker(name: str):
     """Class decorator to register Exif workers."""
     def decorator(cls):
+        cls.worker_name = name
         WORKER_REGISTRY[name] = cls
         return cls
     return decorator
 
 
-def get_worker(name: str, *args, **kwargs):
-    """Instantiate a registered worker."""
+def register_lazy_worker(name: str, target: str) -> None:
+    """Register the worker class at ``target`` ("module:Class") without importing it."""
+    # a class registered by an already imported module wins
+    WORKER_REGISTRY.setdefault(name, target)
+
+
+def load_worker(name: str) -> type:
+    """Return the class registered as ``name``, importing its module if needed."""
     if name not in WORKER_REGISTRY:
         raise ValueError(f"Unknown worker: {name}")
-    return WORKER_REGISTRY[name](*args, **kwargs)
+    cls = WORKER_REGISTRY[name]
+    if isinstance(cls, str):
+        module_name, _, class_name = cls.partition(":")
+        # importing the module runs register_worker, which replaces the entry
+        cls = getattr(importlib.import_module(module_name), class_name)
+        WORKER_REGISTRY[name] = cls
+    return cls
+
+
+def get_worker(name: str, *args, **kwargs):
+    """Instantiate a registered worker."""
+    return load_worker(name)(*args, **kwargs)
 
 
 def convert_to_degrees(value: tuple[int, int, int]) -> float:
@@ -27,17 +55,52 @@ def convert_to_degrees(value: tuple[int, int, int]) -> float:
     return degrees + minutes + seconds
 
 
-def load_metadata(path: str):
-    """Read width, height, exif and iptc data from ``path`` using Pillow."""
-    with Image.open(path) as img:
-        width, height = img.size
-        exif = {
-            **img.getexif(),
-            **img.getexif().get_ifd(ExifTags.Base.ExifOffset),
-        }
-        gps = img.getexif().get_ifd(ExifTags.Base.GPSInfo)
-        if gps:
-            exif |= {**gps}
-        iptc_data = IptcImagePlugin.getiptcinfo(img)
-        iptc = {**iptc_data} if iptc_data else {}
+def read_metadata(img: Image.Image):
+    """Read width, height, exif and iptc data from an opened Pillow image."""
+    width, height = img.size
+    img_exif = img.getexif()
+    exif = {
+        **img_exif,
+        **img_exif.get_ifd(ExifTags.Base.ExifOffset),
+    }
+    gps = img_exif.get_ifd(ExifTags.Base.GPSInfo)
+    if gps:
+        exif |= {**gps}
+    iptc_data = IptcImagePlugin.getiptcinfo(img)
+    iptc = {**iptc_data} if iptc_data else {}
     return width, height, exif, iptc
+
+
+def count_parse(key=None) -> None:
+    """Record a parse of ``key`` and whether it was seen before."""
+    metrics.PARSES.inc(result="parsed")
+    if key is None:
+        return
+    if key in _recently_parsed:
+        metrics.PARSES.inc(result="reparsed")
+        _recently_parsed.move_to_end(key)
+    else:
+        _recently_parsed[key] = None
+        if len(_recently_parsed) > RECENTLY_PARSED_SIZE:
+            _recently_parsed.popitem(last=False)
+
+
+def load_metadata(path):
+    """Read width, height, exif and iptc data from ``path`` using Pillow.
+
+    ``path`` may also be a :class:`PhotoSource`, which is parsed only once and
+    whose result is handed to every later backend. The returned exif dict is a
+    copy that callers may extend.
+    """
+    if not isinstance(path, PhotoSource):
+        count_parse(path)
+        with Image.open(path) as img:
+            return read_metadata(img)
+
+    if path.metadata is None:
+        count_parse(path.path)
+        path.metadata = read_metadata(path.image)
+    else:
+        metrics.PARSES.inc(result="reused")
+    width, height, exif, iptc = path.metadata
+    return width, height, {**exif}, iptc
@@ -0,0 +1,173 @@
+"""Pool of persistent ``-stay_open`` exiftool processes shared across requests."""
+
+import asyncio
+import atexit
+import contextlib
+import logging
+import os
+import queue
+import threading
+
+import exiftool
+from exiftool.exceptions import ExifToolExecuteError
+
+# number of exiftool processes per Python process and files served before recycling one
+POOL_SIZE = int(os.getenv("FOTOBOT_EXIFTOOL_POOL_SIZE", "1"))
+MAX_FILES = int(os.getenv("FOTOBOT_EXIFTOOL_MAX_FILES", "500"))
+
+
+class PooledExifTool:
+    """An exiftool process together with the number of files it has served."""
+    __slots__ = ("helper", "files")
+
+    def __init__(self) -> None:
+        self.helper = exiftool.ExifToolHelper(common_args=None)
+        self.files = 0
+
+    def start(self) -> None:
+        if not self.helper.running:
+            self.helper.run()
+
+    def terminate(self) -> None:
+        try:
+            if self.helper.running:
+                self.helper.terminate()
+        except Exception as e:
+            logging.warning(f"Cannot terminate exiftool: {e}")
+
+
+class ExifToolPool:
+    """Fixed size pool of long-lived exiftool processes.
+
+    Members are restarted when they crash and recycled after ``max_files`` files.
+    """
+
+    def __init__(self, size: int = POOL_SIZE, max_files: int = MAX_FILES) -> None:
+        self.size = max(size, 1)
+        self.max_files = max_files
+        self._idle = queue.Queue()
+        self._members = []
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start all exiftool processes; calling it again is a no-op."""
+        with self._lock:
+            while len(self._members) < self.size:
+                member = PooledExifTool()
+                member.start()
+                self._members.append(member)
+                self._idle.put(member)
+
+    def close(self) -> None:
+        """Terminate every exiftool process owned by the pool."""
+        with self._lock:
+            for member in self._members:
+                member.terminate()
+            self._members.clear()
+            self._idle = queue.Queue()
+
+    def _acquire(self, timeout=None) -> PooledExifTool:
+        if not self._members:
+            self.start()
+        member = self._idle.get(timeout=timeout)
+        try:
+            member.start()
+        except Exception:
+            self._idle.put(member)
+            raise
+        return member
+
+    def _release(self, member: PooledExifTool, healthy: bool, files: int = 1) -> None:
+        member.files += files
+        if not healthy or member.files >= self.max_files:
+            logging.info("Restarting exiftool after %s files...", member.files)
+            member.terminate()
+            replacement = PooledExifTool()
+            with self._lock:
+                self._members = [replacement if m is member else m for m in self._members]
+            member = replacement
+        self._idle.put(member)
+
+    def _release_unused(self, future: asyncio.Future) -> None:
+        """Return the process acquired for a cancelled :meth:`acheckout`."""
+        if not future.cancelled() and future.exception() is None:
+            self._release(future.result(), True, 0)
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None, files: int = 1):
+        """Borrow an ``ExifToolHelper`` for the duration of the ``with`` block.
+
+        ``files`` is the number of files it will read, counted towards recycling.
+        """
+        member = self._acquire(timeout)
+        healthy = True
+        try:
+            yield member.helper
+        except ExifToolExecuteError:
+            # exiftool reported a problem with the file, the process itself is fine
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self._release(member, healthy, files)
+
+    @contextlib.asynccontextmanager
+    async def acheckout(self, timeout=None):
+        """Async variant of :meth:`checkout` that waits for a free process off-loop.
+
+        The process goes back to the pool when the block exits, also when the
+        task is cancelled: a thread still using it must be joined before that.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self._acquire, timeout)
+        try:
+            # shielded, a cancelled waiter can't stop the thread from taking a process
+            member = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(self._release_unused)
+            raise
+        healthy = True
+        try:
+            yield member.helper
+        except ExifToolExecuteError:
+            raise
+        except Exception:
+            healthy = False
+            raise
+        finally:
+            self._release(member, healthy)
+
+    def _get_metadata(self, files, params):
+        with self.checkout() as et:
+            return et.get_metadata(files, params=params)
+
+    async def get_metadata(self, files, params=None):
+        """Run ``ExifToolHelper.get_metadata`` on a pooled process without blocking the loop.
+
+        The thread checks the process out and in itself, so cancelling the
+        caller can't hand it to someone else while exiftool still answers.
+        """
+        return await asyncio.to_thread(self._get_metadata, files, params)
+
+
+_pool = None
+_pool_pid = None
+
+
+def get_pool() -> ExifToolPool:
+    """Return this process's pool; forked children get their own processes."""
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        _pool = ExifToolPool()
+        _pool_pid = os.getpid()
+        atexit.register(_pool.close)
+    return _pool
+
+
+def start_pool() -> None:
+    """Start this process's pool, logging instead of failing if exiftool is missing."""
+    try:
+        get_pool().start()
+    except Exception as e:
+        logging.warning(f"Cannot start exiftool pool: {e}")
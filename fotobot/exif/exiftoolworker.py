@@ -1,12 +1,15 @@
 import logging
-import exiftool
 import math
 from collections import defaultdict
 from datetime import datetime
-from geopy.geocoders import Nominatim
+from typing import Optional
+from exiftool.exceptions import ExifToolExecuteError
 from PIL import ExifTags
 
 from fotobot.exif.exifworker import ExifWorker
+from fotobot.exif.geocache import reverse_geocode
+from fotobot.exif.source import PhotoSource
+from fotobot.exif.exiftoolpool import get_pool
 from fotobot.exif.base import (
     convert_to_degrees,
     load_metadata,
@@ -16,14 +19,19 @@ from fotobot.exif.base import (
 @register_worker("exiftool")
 class ExifToolWorker(ExifWorker):
 
-    def __init__(self, img_path: str) -> None:
+    def __init__(self, img_path: str, exiftool_metadata: Optional[dict] = None) -> None:
+        """``exiftool_metadata`` is the output of :func:`get_metadata_batch` for this photo."""
         self.img_path = img_path
         self.width, self.height, self.exif, self.iptc = load_metadata(img_path)
 
-        with exiftool.ExifToolHelper(common_args=None) as et:
-            metadata = et.get_metadata(img_path, params=['-fast1'])
+        if exiftool_metadata is not None:
+            self.exif |= exiftool_metadata
+            return
+        path = get_path(img_path)
+        with get_pool().checkout() as et:
+            metadata = et.get_metadata(path, params=['-fast1'])
             if len(metadata) == 0:
-                logging.error(f"Fail to parse file: {img_path}")
+                logging.error(f"Fail to parse file: {path}")
             else:
                 self.exif |= metadata[0]
     
@@ -210,9 +218,9 @@ class ExifToolWorker(ExifWorker):
         if city.startswith("Unknown") or province.startswith("Unknown"):
             lat, lon = self.get_f_latitude_longitude()
             if lat and lon and not math.isnan(lat) and not math.isnan(lon):
-                geolocator = Nominatim(user_agent="fotobot")
-                location = geolocator.reverse((lat, lon), exactly_one=True)
-                return location.address
+                address = reverse_geocode(lat, lon)
+                if address:
+                    return address
             
         return f"{province}, {city}" 
     
@@ -257,3 +265,30 @@ class ExifToolWorker(ExifWorker):
         if lat and lon and not math.isnan(lat) and not math.isnan(lon):
             return f"{lat:.6f}° {gps_latitude_ref}, {lon:.6f}° {gps_longitude_ref}"
         return "Unknown GPS Coordinate"
+
+
+def get_path(img_path) -> str:
+    return img_path.get_path() if isinstance(img_path, PhotoSource) else img_path
+
+
+def get_metadata_batch(img_paths: list) -> list:
+    """Read several photos with a single exiftool invocation.
+
+    Returns one dict per photo, empty for photos exiftool could not read.
+    """
+    paths = [get_path(img_path) for img_path in img_paths]
+    try:
+        with get_pool().checkout(files=len(paths)) as et:
+            metadata = et.get_metadata(paths, params=['-fast1'])
+    except ExifToolExecuteError as e:
+        if len(paths) == 1:
+            logging.error(f"Fail to parse file: {paths[0]}: {e}")
+            return [{}]
+        # a single unreadable file fails the whole run, retry them one by one
+        return [item for path in paths for item in get_metadata_batch([path])]
+    by_path = {item.get("SourceFile"): item for item in metadata}
+    result = [by_path.get(path, {}) for path in paths]
+    for path, item in zip(paths, result):
+        if not item:
+            logging.error(f"Fail to parse file: {path}")
+    return result
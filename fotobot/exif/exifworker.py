@@ -2,11 +2,12 @@ from abc import (
     ABC,
     abstractmethod
 )
-import logging
-from string import Template
+from fotobot.exif.metadata import PhotoMetadata
 
 class ExifWorker(ABC):
 
+    _metadata = None
+
     @abstractmethod
     def get_camera(self) -> str:
         pass
@@ -88,32 +89,34 @@ class ExifWorker(ABC):
         pass
 
 
+    def get_metadata(self) -> PhotoMetadata:
+        """Evaluate every getter once and keep the result for later calls."""
+        if self._metadata is None:
+            lat, lon = self.get_f_latitude_longitude()
+            self._metadata = PhotoMetadata(
+                camera=self.get_camera(),
+                lens=self.get_lens(),
+                focal_length=self.get_focal_length(),
+                focal_length_in_35mm=self.get_focal_length_in_35mm(),
+                aperture=self.get_aperture(),
+                shutter_speed=self.get_shutter_speed(),
+                iso=self.get_iso(),
+                exposure_compensation=self.get_exposure_compensation(),
+                datetime=self.get_datetime(),
+                metering_mode=self.get_metering_mode(),
+                orientation=self.get_orientation(),
+                image_dimensions=self.get_image_dimensions(),
+                bits_per_sample=self.get_bits_per_sample(),
+                author=self.get_author(),
+                title=self.get_title(),
+                country=self.get_country(),
+                location=self.get_location(),
+                keywords=self.get_keywords(),
+                gps_coordinates=self.get_latitude_longitude(),
+                latitude=lat,
+                longitude=lon,
+            )
+        return self._metadata
+
     def get_description(self, template: str) -> str:
-        mapping = {
-            'camera': self.get_camera(),
-            'lens': self.get_lens(),
-            'focal_length': self.get_focal_length(),
-            'focal_length_in_35mm': self.get_focal_length_in_35mm(), # 'focal_length_35mm' is added to the mapping
-            'aperture': self.get_aperture(),
-            'shutter_speed': self.get_shutter_speed(),
-            'iso': self.get_iso(),
-            'exposure_compensation': self.get_exposure_compensation(),
-            'datetime': self.get_datetime(),
-            'metering_mode': self.get_metering_mode(),
-            'image_dimensions': self.get_image_dimensions(),
-            'bits_per_sample': self.get_bits_per_sample(),
-            'author': self.get_author(),
-            'title': self.get_title(),
-            'country': self.get_country(),
-            'location': self.get_location(),
-            'keywords': self.get_keywords(),
-            'gps_coordinates': self.get_latitude_longitude(),
-        }
-
-        try:
-            template = Template(template)
-            description = template.safe_substitute(mapping)
-            return description
-        except KeyError as e:
-            logging.error(f"Invalid style: {e}")
-            return ""
+        return self.get_metadata().get_description(template)
@@ -0,0 +1,229 @@
+"""Reverse geocoding behind an in-memory LRU and a persistent SQLite cache."""
+
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fotobot import metrics
+
+# decimal places kept from lat/lon for the cache key, 3 is roughly 100 m
+PRECISION = int(os.getenv("FOTOBOT_GEOCODE_PRECISION", "3"))
+TTL = float(os.getenv("FOTOBOT_GEOCODE_TTL", str(30 * 24 * 3600)))
+# lookups that found no address or failed are retried after this many seconds
+NEGATIVE_TTL = float(os.getenv("FOTOBOT_GEOCODE_NEGATIVE_TTL", "3600"))
+MEMORY_SIZE = int(os.getenv("FOTOBOT_GEOCODE_MEMORY_SIZE", "4096"))
+DB_SIZE = int(os.getenv("FOTOBOT_GEOCODE_DB_SIZE", "200000"))
+DB_PATH = os.getenv("FOTOBOT_GEOCODE_DB", "geocode_cache.sqlite3")
+# seconds between two Nominatim requests, its usage policy allows one per second
+MIN_INTERVAL = float(os.getenv("FOTOBOT_GEOCODE_INTERVAL", "1"))
+
+# run the size based eviction of the SQLite store every N inserts
+EVICT_EVERY = 256
+# access times of disk hits are written in batches of this many
+TOUCH_EVERY = 256
+# cached address of coordinates Nominatim has no address for
+NOT_FOUND = ""
+
+
+class GeocodeCache:
+    """Address cache keyed by coordinates quantized to ``precision`` decimals.
+
+    Entries expire after ``ttl`` seconds, failed lookups cached as
+    :data:`NOT_FOUND` after ``negative_ttl``. The memory layer holds at most
+    ``memory_size`` entries and the SQLite store at most ``db_size``, evicting
+    the least recently used ones. Hits don't write, their access times are
+    saved in batches.
+    """
+
+    def __init__(self, path: str = DB_PATH, precision: int = PRECISION, ttl: float = TTL,
+                 memory_size: int = MEMORY_SIZE, db_size: int = DB_SIZE,
+                 negative_ttl: float = NEGATIVE_TTL) -> None:
+        self.precision = precision
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory_size = memory_size
+        self.db_size = db_size
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._inserts = 0
+        # key -> access time of disk hits not written yet
+        self._touched = {}
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            "lat INTEGER, lon INTEGER, address TEXT, created REAL, accessed REAL, "
+            "PRIMARY KEY (lat, lon))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode (accessed)")
+        self._db.commit()
+
+    def quantize(self, lat: float, lon: float) -> (int, int):
+        scale = 10 ** self.precision
+        return round(lat * scale), round(lon * scale)
+
+    def get_ttl(self, address: str) -> float:
+        return self.negative_ttl if address == NOT_FOUND else self.ttl
+
+    def get(self, lat: float, lon: float) -> Optional[str]:
+        """The cached address, :data:`NOT_FOUND` for a recent failure, ``None`` on a miss."""
+        key = self.quantize(lat, lon)
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                address, created = entry
+                if now - created < self.get_ttl(address):
+                    self._memory.move_to_end(key)
+                    metrics.CACHE_EVENTS.inc(cache="geocode", result="memory")
+                    return address
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT address, created FROM geocode WHERE lat = ? AND lon = ?", key
+            ).fetchone()
+            if row is None:
+                metrics.CACHE_EVENTS.inc(cache="geocode", result="miss")
+                return None
+            address, created = row
+            if now - created >= self.get_ttl(address):
+                # replaced by the next put or removed by the eviction
+                metrics.CACHE_EVENTS.inc(cache="geocode", result="expired")
+                return None
+            self._touched[key] = now
+            if len(self._touched) >= TOUCH_EVERY:
+                self._write_touched()
+                self._db.commit()
+            self._remember(key, address, created)
+            metrics.CACHE_EVENTS.inc(cache="geocode", result="disk")
+            return address
+
+    def put(self, lat: float, lon: float, address: str) -> None:
+        key = self.quantize(lat, lon)
+        now = time.time()
+        with self._lock:
+            self._remember(key, address, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO geocode (lat, lon, address, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)", (*key, address, now, now)
+            )
+            self._inserts += 1
+            if self._inserts % EVICT_EVERY == 0:
+                self._write_touched()
+                self._evict(now)
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._write_touched()
+            self._db.commit()
+            self._db.close()
+
+    def _write_touched(self) -> None:
+        touched, self._touched = self._touched, {}
+        self._db.executemany(
+            "UPDATE geocode SET accessed = ? WHERE lat = ? AND lon = ?",
+            [(accessed, *key) for key, accessed in touched.items()]
+        )
+
+    def _remember(self, key, address: str, created: float) -> None:
+        self._memory[key] = (address, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now: float) -> None:
+        self._db.execute("DELETE FROM geocode WHERE created <= ?", (now - self.ttl,))
+        self._db.execute(
+            "DELETE FROM geocode WHERE address = ? AND created <= ?", (NOT_FOUND, now - self.negative_ttl)
+        )
+        self._db.execute(
+            "DELETE FROM geocode WHERE rowid IN ("
+            "SELECT rowid FROM geocode ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.db_size,)
+        )
+
+
+class RateLimiter:
+    """Spaces calls at least ``interval`` seconds apart.
+
+    Shared by threads, and by processes when handed to the pool initializer.
+    """
+
+    def __init__(self, interval: float = MIN_INTERVAL) -> None:
+        self.interval = interval
+        self._lock = multiprocessing.Lock()
+        # monotonic time of the next free slot, the clock is system wide
+        self._next = multiprocessing.RawValue("d", 0.0)
+
+    def wait(self) -> None:
+        """Block until the caller may make its call."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+_cache = None
+_cache_pid = None
+_geolocator = None
+_rate_limiter = None
+_rate_limiter_pid = None
+
+
+def get_cache() -> GeocodeCache:
+    """Return this process's cache, reopening the database after a fork."""
+    global _cache, _cache_pid
+    if _cache is None or _cache_pid != os.getpid():
+        _cache = GeocodeCache()
+        _cache_pid = os.getpid()
+    return _cache
+
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Share ``limiter`` with the other processes of a pool, called by its initializer."""
+    global _rate_limiter, _rate_limiter_pid
+    _rate_limiter = limiter
+    _rate_limiter_pid = os.getpid()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return the limiter set for this process, or one of its own."""
+    if _rate_limiter is None or _rate_limiter_pid != os.getpid():
+        set_rate_limiter(RateLimiter())
+    return _rate_limiter
+
+
+def reverse_geocode(lat: float, lon: float) -> Optional[str]:
+    """Return the address at ``lat``/``lon``, asking Nominatim only on a cache miss."""
+    global _geolocator
+    cache = get_cache()
+    address = cache.get(lat, lon)
+    if address is not None:
+        return address or None
+
+    if _geolocator is None:
+        # geopy pulls in aiohttp, only load it for the first address looked up
+        from geopy.geocoders import Nominatim
+        _geolocator = Nominatim(user_agent="fotobot")
+    get_rate_limiter().wait()
+    try:
+        with metrics.stage("geocode"):
+            location = _geolocator.reverse((lat, lon), exactly_one=True)
+    except Exception as e:
+        logging.warning(f"Geocoding {lat}, {lon} failed: {e}")
+        location = None
+    if location is None:
+        logging.warning(f"No address found for {lat}, {lon}")
+        cache.put(lat, lon, NOT_FOUND)
+        return None
+    cache.put(lat, lon, location.address)
+    return location.address
@@ -0,0 +1,31 @@
+"""HEIF and AVIF support for Pillow, registered once per process."""
+
+import os
+
+# decoding threads per image, 0 keeps each plugin's default
+DECODE_THREADS = int(os.getenv("FOTOBOT_HEIF_DECODE_THREADS", "0"))
+
+_registered = False
+
+
+def register_plugins() -> None:
+    """Register the HEIF and AVIF openers with Pillow; later calls are no-ops.
+
+    Opening a file only parses the container, so metadata is read without
+    decoding any pixels. Captions and previews need the primary image alone,
+    thumbnails and depth maps are therefore not read, and AVIF chroma is
+    upsampled the fastest way as previews are downscaled anyway.
+    """
+    global _registered
+    if _registered:
+        return
+    from pillow_heif import register_heif_opener
+    from pillow_avif import AvifImagePlugin
+
+    options = {"thumbnails": False, "depth_images": False}
+    if DECODE_THREADS:
+        options["decode_threads"] = DECODE_THREADS
+        AvifImagePlugin.DEFAULT_MAX_THREADS = DECODE_THREADS
+    register_heif_opener(**options)
+    AvifImagePlugin.CHROMA_UPSAMPLING = "fastest"
+    _registered = True
@@ -0,0 +1,41 @@
+import logging
+from string import Template
+from typing import NamedTuple, Optional
+
+
+class PhotoMetadata(NamedTuple):
+    """Immutable snapshot of every value a worker exposes, evaluated once.
+
+    Field names match the placeholders used by the style templates.
+    """
+    camera: str
+    lens: str
+    focal_length: str
+    focal_length_in_35mm: str
+    aperture: str
+    shutter_speed: str
+    iso: str
+    exposure_compensation: str
+    datetime: str
+    metering_mode: str
+    orientation: int
+    image_dimensions: str
+    bits_per_sample: str
+    author: str
+    title: str
+    country: str
+    location: str
+    keywords: str
+    gps_coordinates: str
+    latitude: Optional[float]
+    longitude: Optional[float]
+
+    def get_description(self, template) -> str:
+        """Fill ``template``, a string or precompiled ``Template``, with this record."""
+        try:
+            if not isinstance(template, Template):
+                template = Template(template)
+            return template.safe_substitute(self._asdict())
+        except KeyError as e:
+            logging.error(f"Invalid style: {e}")
+            return ""
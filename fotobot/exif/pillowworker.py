@@ -3,10 +3,10 @@ from fractions import Fraction
 import logging
 from datetime import datetime
 from enum import IntEnum
-from geopy.geocoders import Nominatim
 from PIL import ExifTags
 
 from fotobot.exif.exifworker import ExifWorker
+from fotobot.exif.geocache import reverse_geocode
 from fotobot.exif.base import (
     convert_to_degrees,
     load_metadata,
@@ -201,9 +201,9 @@ class PillowWorker(ExifWorker):
         if city.startswith("Unknown") or province.startswith("Unknown"):
             lat, lon = self.get_f_latitude_longitude()
             if lat and lon and not math.isnan(lat) and not math.isnan(lon):
-                geolocator = Nominatim(user_agent="fotobot")
-                location = geolocator.reverse((lat, lon), exactly_one=True)
-                return location.address
+                address = reverse_geocode(lat, lon)
+                if address:
+                    return address
         
         return f"{province}, {city}" 
     
@@ -0,0 +1,101 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from PIL import Image
+
+
+class PhotoSource:
+    """An uploaded photo held on disk or in memory and opened at most once.
+
+    The Pillow handle and the parsed metadata are shared by every backend and
+    by resizing. A file is only written for in-memory photos when a backend
+    asks for a path.
+    """
+
+    def __init__(self, path: Optional[str] = None, data: Optional[bytes] = None,
+                 tmp_dir: Optional[str] = None) -> None:
+        if path is None and data is None:
+            raise ValueError("PhotoSource needs a path or data")
+        self.path = path
+        self.data = data
+        self.tmp_dir = tmp_dir
+        # (width, height, exif, iptc) once parsed by load_metadata
+        self.metadata = None
+        self._image = None
+        self._tmp_path = None
+        self._digest = None
+
+    def __getstate__(self):
+        # open handles and temporary files stay with the process that created them
+        state = self.__dict__.copy()
+        state["_image"] = None
+        state["_tmp_path"] = None
+        return state
+
+    def __enter__(self) -> "PhotoSource":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def image(self) -> Image.Image:
+        """Lazily opened Pillow image, pixels are decoded on first access."""
+        if self._image is None:
+            fp = self.path if self.path is not None else io.BytesIO(self.data)
+            self._image = Image.open(fp)
+        return self._image
+
+    def head(self, size: int) -> bytes:
+        """Return the first ``size`` bytes of the photo."""
+        if self.data is not None:
+            return self.data[:size]
+        with open(self.path, "rb") as f:
+            return f.read(size)
+
+    def digest(self) -> str:
+        """SHA-256 hex digest of the photo's bytes, computed once."""
+        if self._digest is None:
+            if self.data is not None:
+                self._digest = hashlib.sha256(self.data).hexdigest()
+            else:
+                sha = hashlib.sha256()
+                with open(self.path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        sha.update(chunk)
+                self._digest = sha.hexdigest()
+        return self._digest
+
+    def get_path(self) -> str:
+        """Return a path to the photo, writing in-memory data to a temp file once."""
+        if self.path is not None:
+            return self.path
+        if self._tmp_path is None:
+            fd, self._tmp_path = tempfile.mkstemp(suffix="_img", dir=self.tmp_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.data)
+        return self._tmp_path
+
+    def release_image(self) -> None:
+        """Free the decoded pixels, the image is opened again on next access."""
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+    def close(self) -> None:
+        self.release_image()
+        if self._tmp_path is not None:
+            try:
+                os.remove(self._tmp_path)
+            except OSError as e:
+                logging.error(f"Can't remove temporary file: {e}")
+            self._tmp_path = None
+
+
+def as_source(photo) -> PhotoSource:
+    """Wrap a plain path into a :class:`PhotoSource`."""
+    return photo if isinstance(photo, PhotoSource) else PhotoSource(path=photo)
@@ -1,4 +1,7 @@
+import itertools
 from enum import Enum
+from functools import lru_cache
+from string import Template
 
 
 class Style(Enum):
@@ -111,3 +114,27 @@ def get_pretty_style(full_frame=False, is_unknown=False, country=False, location
         style += "📍: $gps_coordinates\n"
     
     return style[:-1]
+
+
+STYLE_BUILDERS = {
+    Style.DEFAULT: get_default_style,
+    Style.FULL: get_full_style,
+    Style.PRETTY: get_pretty_style,
+}
+
+
+@lru_cache(maxsize=None)
+def get_compiled_template(style: Style, *flags: bool) -> Template:
+    """Return the memoized ``Template`` built by ``style``'s builder for ``flags``."""
+    return Template(STYLE_BUILDERS[style](*flags))
+
+
+def warm_templates() -> int:
+    """Build every (style, flags) variant ahead of time, return how many there are."""
+    count = 0
+    for style, builder in STYLE_BUILDERS.items():
+        n_flags = builder.__code__.co_argcount
+        for flags in itertools.product((False, True), repeat=n_flags):
+            get_compiled_template(style, *flags)
+            count += 1
+    return count
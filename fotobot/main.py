@@ -1,4 +1,6 @@
+import asyncio
 import logging
+import config
 from config import TOKEN, LOGGING_LEVEL
 from fotobot.bot.app import build_app
 
@@ -11,9 +13,22 @@ def main() -> None:
     logger = logging.getLogger(__name__)
     logger.info("Starting bot...")
     application = build_app(TOKEN)
-    application.run_polling()
+
+    # Setting WEBHOOK_URL in config switches from long polling to a webhook
+    webhook_url = getattr(config, "WEBHOOK_URL", None)
+    if webhook_url:
+        from fotobot.bot.webhook import run_webhook
+        asyncio.run(run_webhook(
+            application,
+            webhook_url,
+            listen=getattr(config, "WEBHOOK_LISTEN", "0.0.0.0"),
+            port=getattr(config, "WEBHOOK_PORT", 8443),
+            secret_token=getattr(config, "WEBHOOK_SECRET", None),
+            max_connections=getattr(config, "WEBHOOK_MAX_CONNECTIONS", 40),
+        ))
+    else:
+        application.run_polling()
 
 
 if __name__ == "__main__":
     main()
-
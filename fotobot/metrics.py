@@ -0,0 +1,230 @@
+"""In-process metrics with a Prometheus text endpoint.
+
+Observations made inside process pool workers are drained into the result
+of the job and merged into the main process's registry by the caller.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+
+METRICS_HOST = os.getenv("FOTOBOT_METRICS_HOST", "127.0.0.1")
+# 0 disables the scrape endpoint
+METRICS_PORT = int(os.getenv("FOTOBOT_METRICS_PORT", "0"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REGISTRY = {}
+COLLECTORS = []
+
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+        REGISTRY[name] = self
+
+    def label_key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def format_labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def drain(self) -> dict:
+        with self._lock:
+            values, self.values = self.values, {}
+        return values
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.label_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def merge(self, values: dict) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list:
+        with self._lock:
+            return [f"{self.name}{self.format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # per bucket counts (last one is +Inf), sum, count
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def merge(self, values: dict) -> None:
+        with self._lock:
+            for key, (counts, total, count) in values.items():
+                entry = self.values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0, 0])
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+                entry[2] += count
+
+    def render(self) -> list:
+        lines = []
+        with self._lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    le = f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{self.format_labels(key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{self.format_labels(key)} {count}")
+        return lines
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_SECONDS = Histogram(
+    "fotobot_stage_seconds", "Time spent in each stage of handling a photo",
+    ("stage", "backend", "mimetype", "style"),
+)
+ERRORS = Counter("fotobot_errors_total", "Requests that ended with an error reply", ("kind",))
+EXIFTOOL_FALLBACKS = Counter(
+    "fotobot_exiftool_fallbacks_total", "Pillow parses that had to fall back to exiftool"
+)
+PASSTHROUGHS = Counter(
+    "fotobot_passthrough_total", "Previews sent as the uploaded JPEG without re-encoding"
+)
+ADMISSIONS = Counter(
+    "fotobot_decode_admissions_total", "Decodes admitted or refused by the memory budget", ("result",)
+)
+# "parsed": Pillow parses, "reparsed": parses of a file the same process parsed
+# before, "reused": parses avoided by handing a PhotoSource forward
+PARSES = Counter("fotobot_parse_total", "EXIF parses by outcome", ("result",))
+CACHE_EVENTS = Counter("fotobot_cache_total", "Cache lookups by cache and result", ("cache", "result"))
+
+
+class StageTimer:
+    """Collects stage durations until the labels of the request are known."""
+    __slots__ = ("timings",)
+
+    def __init__(self) -> None:
+        self.timings = []
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings.append((name, time.perf_counter() - started))
+
+    def observe(self, **labels) -> None:
+        for name, seconds in self.timings:
+            STAGE_SECONDS.observe(seconds, stage=name, **labels)
+
+
+_current_timer = contextvars.ContextVar("fotobot_stage_timer", default=None)
+
+
+@contextlib.contextmanager
+def track_stages():
+    """Make :func:`stage` record into a new :class:`StageTimer` for this block."""
+    timer = StageTimer()
+    token = _current_timer.set(timer)
+    try:
+        yield timer
+    finally:
+        _current_timer.reset(token)
+
+
+def stage(name: str):
+    """Time a stage into the active :func:`track_stages` block, if there is one."""
+    timer = _current_timer.get()
+    return timer.stage(name) if timer is not None else contextlib.nullcontext()
+
+
+def drain() -> dict:
+    """Take every observation of this process, used to ship them out of pool workers."""
+    return {name: metric.drain() for name, metric in REGISTRY.items()}
+
+
+def merge(drained: dict) -> None:
+    """Add observations returned by :func:`drain` in another process."""
+    for name, values in drained.items():
+        if values and name in REGISTRY:
+            REGISTRY[name].merge(values)
+
+
+def register_collector(func) -> None:
+    """Add a callable returning ``(name, kind, documentation, [(labels, value)])`` tuples,
+    evaluated on every scrape."""
+    COLLECTORS.append(func)
+
+
+def render() -> str:
+    """Prometheus text exposition of every metric."""
+    lines = []
+    for metric in REGISTRY.values():
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    for collector in COLLECTORS:
+        try:
+            samples = collector()
+        except Exception as e:
+            logging.error(f"Metrics collector failed: {e}")
+            continue
+        for name, kind, documentation, values in samples:
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in values:
+                label_text = ",".join(f'{k}="{escape_label(str(v))}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Serve ``/metrics`` on ``host:port``; returns the runner to clean up, or ``None``."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Metrics available at http://%s:%s/metrics", host, port)
+    return runner
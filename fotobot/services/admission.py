@@ -0,0 +1,84 @@
+"""Admission control bounding the memory held by decoded images.
+
+Every decode reserves its size from one budget shared by all pool workers
+before it starts. When the budget is used up the worker waits for others to
+release theirs, and gives up with :class:`BusyError` after ``DECODE_WAIT``
+seconds so the user gets a quick reply instead of the bot being OOM killed.
+"""
+
+import contextlib
+import logging
+import multiprocessing
+import os
+from typing import Optional
+
+from fotobot import metrics
+
+# bytes of decoded pixels all workers may hold at once, 0 disables the check
+DECODE_BUDGET = int(os.getenv("FOTOBOT_DECODE_BUDGET", str(1024 * 1024 * 1024)))
+# seconds a decode waits for budget before the request is answered as busy
+DECODE_WAIT = float(os.getenv("FOTOBOT_DECODE_WAIT", "10"))
+
+
+class BusyError(Exception):
+    """Raised when a decode did not get its share of the budget in time."""
+
+
+class DecodeBudget:
+    """Byte budget shared between threads and, when passed to the pool
+    initializer, processes.
+
+    A single image larger than the whole budget is admitted once nothing
+    else is decoding, so it runs alone instead of never.
+    """
+
+    def __init__(self, max_bytes: int = DECODE_BUDGET, wait: float = DECODE_WAIT) -> None:
+        self.max_bytes = max_bytes
+        self.wait = wait
+        self._used = multiprocessing.RawValue("q", 0)
+        self._condition = multiprocessing.Condition()
+
+    @property
+    def used(self) -> int:
+        return self._used.value
+
+    @contextlib.contextmanager
+    def reserve(self, nbytes: int):
+        """Hold ``nbytes`` of the budget for the duration of the block."""
+        nbytes = min(nbytes, self.max_bytes)
+        with metrics.stage("admission"), self._condition:
+            if not self._condition.wait_for(lambda: self._used.value + nbytes <= self.max_bytes, self.wait):
+                metrics.ADMISSIONS.inc(result="busy")
+                raise BusyError(nbytes)
+            self._used.value += nbytes
+        metrics.ADMISSIONS.inc(result="admitted")
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._used.value -= nbytes
+                self._condition.notify_all()
+
+
+_budget: Optional[DecodeBudget] = None
+
+
+def create_budget() -> Optional[DecodeBudget]:
+    """A new budget from the settings, or ``None`` when admission control is disabled."""
+    if not DECODE_BUDGET:
+        return None
+    logging.info("Decode budget of %s MiB", DECODE_BUDGET // (1024 * 1024))
+    return DecodeBudget()
+
+
+def set_budget(budget: Optional[DecodeBudget]) -> None:
+    """Use ``budget`` for the decodes of this process, called by the pool initializer."""
+    global _budget
+    _budget = budget
+
+
+def reserve(nbytes: int):
+    """:meth:`DecodeBudget.reserve` on this process's budget, a no-op without one."""
+    if _budget is None:
+        return contextlib.nullcontext()
+    return _budget.reserve(nbytes)
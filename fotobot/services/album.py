@@ -0,0 +1,52 @@
+"""Collects the documents of an album so they can be handled as one batch."""
+
+import asyncio
+import os
+import time
+
+# seconds without a new item after which an album is considered complete
+ALBUM_WAIT = float(os.getenv("FOTOBOT_ALBUM_WAIT", "1.0"))
+
+
+class AlbumCollector:
+    """Groups updates by ``media_group_id``.
+
+    Telegram delivers the items of an album as separate updates a few
+    milliseconds apart and never says how many there are.
+    """
+
+    def __init__(self, wait: float = ALBUM_WAIT) -> None:
+        self.wait = wait
+        # media_group_id -> [updates, arrival of the latest one]
+        self._albums = {}
+
+    def add(self, update) -> bool:
+        """Add ``update`` to its album, return whether it is the album's first item."""
+        media_group_id = update.message.media_group_id
+        album = self._albums.get(media_group_id)
+        if album is None:
+            self._albums[media_group_id] = [[update], time.monotonic()]
+            return True
+        album[0].append(update)
+        album[1] = time.monotonic()
+        return False
+
+    async def collect(self, media_group_id) -> list:
+        """Wait until the album has been quiet for ``wait`` seconds and return its updates."""
+        while True:
+            remaining = self._albums[media_group_id][1] + self.wait - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        updates, _ = self._albums.pop(media_group_id)
+        return sorted(updates, key=lambda u: u.message.message_id)
+
+
+_collector = None
+
+
+def get_album_collector() -> AlbumCollector:
+    global _collector
+    if _collector is None:
+        _collector = AlbumCollector()
+    return _collector
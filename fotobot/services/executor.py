@@ -0,0 +1,98 @@
+"""Executor layer that keeps the CPU-bound photo pipeline off the event loop."""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+# "process" or "thread", and the number of workers (0 means one per CPU core)
+EXECUTOR_KIND = os.getenv("FOTOBOT_EXECUTOR", "process")
+POOL_SIZE = int(os.getenv("FOTOBOT_POOL_SIZE", "0"))
+# build every caption template when a worker starts instead of on first use
+WARM_TEMPLATES = os.getenv("FOTOBOT_WARM_TEMPLATES", "0") == "1"
+
+_executor = None
+
+
+def init_worker(budget=None, geocode_limiter=None) -> None:
+    """Register the image plugins and start the long-lived exiftool processes
+    as soon as a pool worker comes up. Decodes reserve memory from ``budget``,
+    a :class:`~fotobot.services.admission.DecodeBudget` shared by the pool,
+    and geocoding requests are spaced by the shared ``geocode_limiter``."""
+    from fotobot import metrics
+    from fotobot.exif.exiftoolpool import start_pool
+    from fotobot.exif.geocache import set_rate_limiter
+    from fotobot.exif.heif import register_plugins
+    from fotobot.services.admission import set_budget
+    # a forked worker starts with a copy of the parent's observations, they
+    # must not be shipped back and counted twice
+    metrics.drain()
+    set_budget(budget)
+    if geocode_limiter is not None:
+        set_rate_limiter(geocode_limiter)
+    register_plugins()
+    start_pool()
+    if WARM_TEMPLATES:
+        from fotobot.exif.styles import warm_templates
+        logging.info("Warmed %s caption templates", warm_templates())
+
+
+def create_executor(kind: str = EXECUTOR_KIND, max_workers: int = POOL_SIZE,
+                    initializer=init_worker, initargs=()) -> Executor:
+    """Build a new process or thread pool executor."""
+    max_workers = max_workers or os.cpu_count() or 1
+    if kind == "process":
+        return ProcessPoolExecutor(max_workers=max_workers, initializer=initializer,
+                                   initargs=initargs)
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fotobot",
+                                  initializer=initializer, initargs=initargs)
+    raise ValueError(f"Unknown executor: {kind}")
+
+
+def get_executor() -> Executor:
+    """Return the shared executor, creating it on first use."""
+    global _executor
+    if _executor is None:
+        from fotobot.exif.geocache import RateLimiter
+        from fotobot.services.admission import create_budget
+        _executor = create_executor(initargs=(create_budget(), RateLimiter()))
+        logging.info("Using %s executor with %s workers...",
+                     EXECUTOR_KIND, POOL_SIZE or os.cpu_count())
+    return _executor
+
+
+def shutdown_executor(wait: bool = True) -> None:
+    """Shut down the shared executor if it was started."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=wait, cancel_futures=True)
+        _executor = None
+
+
+def discard_executor(executor: Executor) -> None:
+    """Drop ``executor`` if it is still the shared one, the next call builds a new pool."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Run ``func(*args, **kwargs)`` in the shared executor and await the result.
+
+    A process pool is unusable once one of its workers died, the job is then
+    retried once in a new pool.
+    """
+    loop = asyncio.get_running_loop()
+    job = partial(func, *args, **kwargs)
+    executor = get_executor()
+    try:
+        return await loop.run_in_executor(executor, job)
+    except BrokenProcessPool:
+        logging.error("A pool worker died, restarting the process pool...")
+        # every job of the broken pool fails at once, only the first one rebuilds it
+        discard_executor(executor)
+        return await loop.run_in_executor(get_executor(), job)
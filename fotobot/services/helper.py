@@ -1,8 +1,17 @@
 from os import remove
+import asyncio
+import functools
 import logging
+import random
 import telegram
 from telegram import Update
-import time
+
+from fotobot.services.outbox import (
+    PRIORITY_ERROR,
+    PRIORITY_PHOTO,
+    PRIORITY_TEXT,
+    get_outbox,
+)
 
 def remove_original_doc_from_server(photo_path, logger):
     """
@@ -10,6 +19,8 @@ def remove_original_doc_from_server(photo_path, logger):
     :param logger: Logger from logging package
     :param update: Update from telegram.update package
     """
+    if photo_path is None:
+        return
     logger.info("Preparing for original file deletion on server")
     try:
         remove(photo_path)
@@ -25,44 +36,120 @@ def escape(text: str) -> str:
     except AttributeError:
         return 'N/A'
 
-def retry_on_error(wait=0.1, retry=0):
-    def decorator(func):
+class RetryPolicy:
+    """Retry an awaitable on network errors without blocking the event loop.
+
+    Waits grow exponentially from ``base_delay`` up to ``max_delay`` with full
+    jitter, and Telegram's ``RetryAfter`` hint is honoured as is. No retry is
+    started that would end after ``deadline`` seconds from the first attempt.
+    """
+
+    def __init__(self, retries: int = 3, base_delay: float = 0.1, max_delay: float = 5.0,
+                 deadline: float = 30.0, jitter: bool = True) -> None:
+        self.retries = retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.jitter = jitter
+
+    def get_delay(self, attempt: int, error: Exception) -> float:
+        if isinstance(error, telegram.error.RetryAfter):
+            return float(error.retry_after)
+        delay = min(self.max_delay, self.base_delay * 2 ** attempt)
+        return random.uniform(0, delay) if self.jitter else delay
+
+    async def run(self, func, *args, **kwargs):
+        """Await ``func(*args, **kwargs)``, retrying according to this policy."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        attempt = 0
+        while True:
+            try:
+                return await func(*args, **kwargs)
+            except telegram.error.BadRequest:
+                # the request itself is wrong, sending it again cannot help
+                raise
+            except (telegram.error.NetworkError, telegram.error.RetryAfter) as e:
+                delay = self.get_delay(attempt, e)
+                attempt += 1
+                if attempt > self.retries or loop.time() - started + delay > self.deadline:
+                    raise
+                logging.warning(f"{type(e).__name__}: {e}. Retrying in {delay:.2f}s...{attempt}")
+                await asyncio.sleep(delay)
+
+    def __call__(self, func):
+        @functools.wraps(func)
         async def inner(*args, **kwargs):
-            i = 0
-            while True:
-                try:
-                    await func(*args, **kwargs)
-                    break
-                except telegram.error.NetworkError:
-                    logging.exception(f"Network Error. Retrying...{i}")
-                    i += 1
-                    time.sleep(wait)
-                    if retry != 0 and i == retry:
-                        raise telegram.error.NetworkError
+            return await self.run(func, *args, **kwargs)
         return inner
-    return decorator
 
-@retry_on_error(retry=3)
-async def reply_photo(update: Update, photo: bytes, caption: str, parse_mode: str):
+
+def retry_on_error(wait=0.1, retry=3):
+    """Decorator form of :class:`RetryPolicy` starting with a ``wait`` second backoff."""
+    return RetryPolicy(retries=retry, base_delay=wait)
+
+
+# shared by every outbound request and download
+SEND_POLICY = RetryPolicy(retries=3)
+
+
+async def send(update: Update, priority: int, func, **kwargs):
+    """Send a Bot API call for ``update``'s chat through the rate limited outbox."""
+    return await get_outbox().submit(update.effective_chat.id, priority, func, **kwargs)
+
+
+async def reply_photo(update: Update, photo, caption: str, parse_mode: str):
+    """Send ``photo`` (bytes or a ``file_id``), return the message or ``None`` on failure."""
     try:
-        await update.message.reply_photo(
+        return await SEND_POLICY.run(
+            send, update, PRIORITY_PHOTO,
+            update.message.reply_photo,
             photo=photo,
             caption=caption,
             parse_mode=parse_mode
         )
     except Exception as e:
-        await update.message.reply_text(
+        await SEND_POLICY.run(
+            send, update, PRIORITY_ERROR,
+            update.message.reply_text,
             text=f"Error occurred: {str(e)}"
         )
 
-@retry_on_error(retry=3)
-async def reply_text(update: Update, text: str, parse_mode: str):
+async def reply_text(update: Update, text: str, parse_mode: str, **kwargs):
     try:
-        await update.message.reply_text(
+        await SEND_POLICY.run(
+            send, update, PRIORITY_TEXT,
+            update.message.reply_text,
             text=text,
-            parse_mode=parse_mode
+            parse_mode=parse_mode,
+            **kwargs
+        )
+    except Exception as e:
+        await SEND_POLICY.run(
+            send, update, PRIORITY_ERROR,
+            update.message.reply_text,
+            text=f"Error occurred: {str(e)}"
+        )
+
+async def reply_location(update: Update, latitude: float, longitude: float):
+    await SEND_POLICY.run(
+        send, update, PRIORITY_TEXT,
+        update.message.reply_location,
+        latitude=latitude,
+        longitude=longitude
+    )
+
+async def reply_media_group(update: Update, media: list):
+    """Send ``media`` as one album, return its messages or ``None`` on failure."""
+    try:
+        return await SEND_POLICY.run(
+            send, update, PRIORITY_PHOTO,
+            update.message.reply_media_group,
+            media=media
         )
     except Exception as e:
-        await update.message.reply_text(
+        await SEND_POLICY.run(
+            send, update, PRIORITY_ERROR,
+            update.message.reply_text,
             text=f"Error occurred: {str(e)}"
         )
@@ -1,35 +1,299 @@
 """Image related helper service."""
 
+import asyncio
+import contextlib
+import logging
+import os
+import uuid
+from multiprocessing import parent_process
+from typing import NamedTuple, Optional, Union
+
 from telegram import Update
 from telegram import constants
+from config import PHOTO_PATH
 
+from fotobot import metrics
+from fotobot.exif.metadata import PhotoMetadata
+from fotobot.exif.source import PhotoSource, as_source
+from fotobot.exif.styles import Style
 from fotobot.services import photo_handler as ph
+from fotobot.services import processing
+from fotobot.services.executor import run_in_executor
+from fotobot.services.helper import remove_original_doc_from_server, reply_text
+from fotobot.services.result_cache import get_result_cache
+
+
+class PhotoResult(NamedTuple):
+    """Output of :func:`process_photo` handed back to the async side.
+
+    ``photo`` is the encoded preview, or the Telegram ``file_id`` of an
+    earlier upload of it when the result comes from the cache.
+    """
+    mimetype: str
+    caption: str
+    coordinates: tuple
+    photo: Union[bytes, str, None]
+    backend: str
+    metadata: PhotoMetadata
+    # observations drained from a pool process, merged by the caller
+    metrics: Optional[dict] = None
+
 
 async def download_file(update: Update, file_path: str) -> None:
     """Download user uploaded file to ``file_path``."""
     await ph.download_image(update, file_path)
 
 
-def parse_metadata(file_path: str):
-    """Return worker and mimetype after validating the file."""
-    mimetype = ph.get_mime(file_path)
-    ph.check_mime(mimetype)
-    worker = ph.get_worker(file_path)
+async def download_source(update: Update, file_path: Optional[str] = None) -> PhotoSource:
+    """Download the upload to ``file_path``, or into memory when it is ``None``."""
+    if file_path is not None:
+        await download_file(update, file_path)
+        return PhotoSource(path=file_path)
+    data = await ph.download_image_to_memory(update)
+    return PhotoSource(data=data, tmp_dir=PHOTO_PATH)
+
+
+def parse_metadata(file_path):
+    """Return worker and mimetype after validating the file.
+
+    The "parse" stage covers reading the file and extracting the tags, the
+    worker's metadata is ready when this returns.
+    """
+    with metrics.stage("mime"):
+        mimetype = processing.get_mime(file_path)
+        processing.check_mime(mimetype)
+    with metrics.stage("parse"):
+        worker = processing.get_worker(file_path)
+        worker.get_metadata()
     return worker, mimetype
 
 
+def describe(metadata: PhotoMetadata, style: int):
+    """Render the caption for ``style`` and extract the coordinates."""
+    with metrics.stage("caption"):
+        template = processing.get_template(metadata, style)
+        caption = processing.get_description(metadata, template)
+    return caption, processing.get_coordinates(metadata)
+
+
 def render_caption(worker, style: int):
     """Render caption and extract coordinates/orientation."""
-    template = ph.get_template(worker, style)
-    caption = ph.get_description(worker, template)
-    coordinates = ph.get_coordinates(worker)
-    orientation = ph.get_orientation(worker)
+    metadata = worker.get_metadata()
+    caption, coordinates = describe(metadata, style)
+    orientation = processing.get_orientation(metadata)
     return caption, coordinates, orientation
 
 
-async def send_response(update: Update, file_path: str, caption: str,
-                        coordinates=None, orientation=None) -> None:
-    """Send processed image or text back to user."""
+def process_photo(source, style: int) -> PhotoResult:
+    """Run the blocking parse/caption/resize/encode stages for ``source``.
+
+    ``source`` is a path or :class:`PhotoSource`, opened once for all stages.
+    Only picklable values are returned so this can run in a process pool.
+    """
+    with metrics.track_stages() as timer, as_source(source) as source:
+        worker, mimetype = parse_metadata(source)
+        caption, coordinates, orientation = render_caption(worker, style)
+        photo = processing.render_photo(source, caption, orientation)
+    timer.observe(backend=worker.worker_name, mimetype=mimetype, style=Style(style).name)
+    return PhotoResult(mimetype, caption, coordinates, photo, worker.worker_name,
+                       worker.get_metadata(), drain_metrics())
+
+
+def drain_metrics() -> Optional[dict]:
+    """Observations to hand back to the main process when running in a pool process."""
+    return metrics.drain() if parent_process() is not None else None
+
+
+def parse_batch(sources: list) -> (list, Optional[dict]):
+    """Parse the photos of an album, running exiftool once for all that need it.
+
+    Returns ``(mimetype, backend, metadata)`` or the exception raised for each
+    source, and the drained metrics.
+    """
+    parsed = [None] * len(sources)
+    mimetypes = {}
+    with contextlib.ExitStack() as stack:
+        sources = [stack.enter_context(as_source(source)) for source in sources]
+        for i, source in enumerate(sources):
+            try:
+                mimetypes[i] = processing.get_mime(source)
+                processing.check_mime(mimetypes[i])
+            except Exception as e:
+                parsed[i] = e
+        valid = [i for i in range(len(sources)) if parsed[i] is None]
+        try:
+            workers = processing.get_workers([sources[i] for i in valid])
+        except Exception as e:
+            workers = [e] * len(valid)
+        for i, worker in zip(valid, workers):
+            if isinstance(worker, Exception):
+                parsed[i] = worker
+                continue
+            try:
+                parsed[i] = (mimetypes[i], worker.worker_name, worker.get_metadata())
+            except Exception as e:
+                parsed[i] = e
+    return parsed, drain_metrics()
+
+
+def render_item(source, caption: str, orientation: int) -> (Optional[bytes], Optional[dict]):
+    """:func:`processing.render_photo` for one photo of an album."""
+    with as_source(source) as source:
+        photo = processing.render_photo(source, caption, orientation)
+    return photo, drain_metrics()
+
+
+async def compute_result(update: Update, style: int, timer: metrics.StageTimer) -> PhotoResult:
+    """Download the upload and run :func:`process_photo` in the executor."""
+    ph.validate_upload(update)
+    file_path = f"{PHOTO_PATH}/{uuid.uuid4()}_img" if ph.PIPELINE == "disk" else None
+    try:
+        with timer.stage("download"):
+            source = await download_source(update, file_path)
+        logging.info("Download completed from user %s", update.message.from_user.full_name)
+        result = await run_in_executor(process_photo, source, style)
+    finally:
+        if file_path is not None and os.path.exists(file_path):
+            remove_original_doc_from_server(file_path, logging.getLogger(__name__))
+    if result.metrics:
+        metrics.merge(result.metrics)
+    return result._replace(metrics=None)
+
+
+def restyle(result: PhotoResult, style: int) -> Optional[PhotoResult]:
+    """``result`` captioned for ``style``, ``None`` if that needs a photo it lacks."""
+    caption, coordinates = describe(result.metadata, style)
+    photo = result.photo if processing.wants_photo(caption) else None
+    if photo is None and processing.wants_photo(caption):
+        return None
+    return result._replace(caption=caption, coordinates=coordinates, photo=photo)
+
+
+async def get_result(update: Update, style: int, timer: metrics.StageTimer) -> PhotoResult:
+    """Return the processed upload, skipping download and parsing on a cache hit.
+
+    Entries are keyed by the attachment's ``file_unique_id``, which stays the
+    same when a document is forwarded or sent again. Concurrent requests for
+    one file share a single download and parse.
+    """
+    cache = get_result_cache()
+    key = update.message.effective_attachment.file_unique_id
+    cached = cache.get(key)
+    if cached is not None:
+        result = restyle(cached, style)
+        if result is not None:
+            metrics.CACHE_EVENTS.inc(cache="result", result="hit")
+            return result
+
+    result, shared = await cache.run_once(key, compute_result, update, style, timer)
+    if not shared:
+        metrics.CACHE_EVENTS.inc(cache="result", result="miss")
+        # keep the metadata, the preview is remembered by file_id once sent
+        cache.put(key, result._replace(photo=None))
+        return result
+    metrics.CACHE_EVENTS.inc(cache="result", result="shared")
+    return restyle(result, style) or (await compute_result(update, style, timer))
+
+
+async def download_item(update: Update) -> PhotoSource:
+    ph.validate_upload(update)
+    file_path = f"{PHOTO_PATH}/{uuid.uuid4()}_img" if ph.PIPELINE == "disk" else None
+    return await download_source(update, file_path)
+
+
+async def process_album(updates: list, style: int) -> list:
+    """Return a :class:`PhotoResult`, or the exception raised, for every item of an album.
+
+    Cached items are reused, the others are downloaded in parallel, parsed
+    in a single job and rendered in parallel.
+    """
+    cache = get_result_cache()
+    results = [None] * len(updates)
+    for i, update in enumerate(updates):
+        cached = cache.get(update.message.effective_attachment.file_unique_id)
+        results[i] = restyle(cached, style) if cached is not None else None
+        metrics.CACHE_EVENTS.inc(cache="result", result="miss" if results[i] is None else "hit")
+    todo = [i for i, result in enumerate(results) if result is None]
+    if not todo:
+        return results
+
+    downloads = await asyncio.gather(*(download_item(updates[i]) for i in todo), return_exceptions=True)
+    sources = {}
+    try:
+        for i, source in zip(todo, downloads):
+            if isinstance(source, Exception):
+                results[i] = source
+            else:
+                sources[i] = source
+        if not sources:
+            return results
+
+        parsed, drained = await run_in_executor(parse_batch, list(sources.values()))
+        if drained:
+            metrics.merge(drained)
+        jobs = {}
+        for i, item in zip(sources, parsed):
+            if isinstance(item, Exception):
+                results[i] = item
+                continue
+            mimetype, backend, metadata = item
+            caption, coordinates = describe(metadata, style)
+            results[i] = PhotoResult(mimetype, caption, coordinates, None, backend, metadata)
+            jobs[i] = run_in_executor(render_item, sources[i], caption, processing.get_orientation(metadata))
+
+        rendered = await asyncio.gather(*jobs.values(), return_exceptions=True)
+        for i, item in zip(jobs, rendered):
+            if isinstance(item, Exception):
+                results[i] = item
+                continue
+            photo, drained = item
+            if drained:
+                metrics.merge(drained)
+            cache.put(updates[i].message.effective_attachment.file_unique_id, results[i])
+            results[i] = results[i]._replace(photo=photo)
+    finally:
+        for source in sources.values():
+            if source.path is not None and os.path.exists(source.path):
+                remove_original_doc_from_server(source.path, logging.getLogger(__name__))
+    return results
+
+
+async def send_album(updates: list, results: list) -> None:
+    """Reply to an album with one media group plus a message for each item that has no photo."""
+    parse_mode = constants.ParseMode.HTML
+    photos = [(update, result) for update, result in zip(updates, results)
+              if isinstance(result, PhotoResult) and result.photo is not None]
+    if len(photos) == 1:
+        update, result = photos[0]
+        remember_upload(update, await send_response(update, result.photo, result.caption, result.coordinates))
+    elif photos:
+        # a media group holds 2 to 10 items, as many as an album can have
+        file_ids = await ph.send_media_group(
+            updates[0], [(result.photo, result.caption) for _, result in photos], parse_mode
+        )
+        for (update, result), file_id in zip(photos, file_ids):
+            remember_upload(update, file_id)
+            await ph.send_location(update, result.coordinates)
+
+    for update, result in zip(updates, results):
+        if isinstance(result, Exception):
+            kind, description = ph.get_error_reply(result)
+            metrics.ERRORS.inc(kind=kind)
+            logging.error(description)
+            logging.error(result.args)
+            await reply_text(update, description, parse_mode)
+        elif result.photo is None:
+            await send_response(update, None, result.caption)
+
+
+def remember_upload(update: Update, file_id: Optional[str]) -> None:
+    """Store the ``file_id`` of the sent preview so cache hits can resend it."""
+    if file_id is not None:
+        get_result_cache().update(update.message.effective_attachment.file_unique_id, photo=file_id)
+
+
+async def send_response(update: Update, photo: Union[bytes, str, None], caption: str,
+                        coordinates=None) -> Optional[str]:
+    """Send processed image or text back to user, return the photo's ``file_id``."""
     parse_mode = constants.ParseMode.HTML
-    await ph.send_msg(update, file_path, caption, parse_mode,
-                      coordinates, orientation)
+    return await ph.send_msg(update, photo, caption, parse_mode, coordinates)
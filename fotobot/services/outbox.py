@@ -0,0 +1,212 @@
+"""Outbound send queue shaped by global and per-chat token buckets."""
+
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import Counter
+
+# Telegram allows about 30 messages per second overall and 1 per second per chat
+GLOBAL_RATE = float(os.getenv("FOTOBOT_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("FOTOBOT_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("FOTOBOT_CHAT_BURST", "3"))
+
+# lower value is sent first
+PRIORITY_ERROR, PRIORITY_TEXT, PRIORITY_PHOTO = range(3)
+
+# drop idle per-chat buckets once there are more than this many
+MAX_IDLE_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Classic token bucket refilled at ``rate`` tokens per second up to ``capacity``."""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until a token is available, 0 if one is available now."""
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class OutboundJob:
+    __slots__ = ("priority", "seq", "chat_id", "func", "args", "kwargs", "future", "queued")
+
+    def __init__(self, priority, seq, chat_id, func, args, kwargs, future) -> None:
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued = time.monotonic()
+
+
+class Outbox:
+    """Single dispatcher that releases queued Bot API calls at the allowed rate.
+
+    Among the jobs whose chat has a token left, the one with the lowest priority
+    value is sent first, FIFO within a priority. Sends run as separate tasks so a
+    slow photo upload does not hold back other chats.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: float = CHAT_BURST) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._pending = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._dispatcher = None
+        self._in_flight = set()
+        self.sent = Counter()
+        self.wait_time = Counter()
+
+    def depth(self) -> Counter:
+        """Number of queued jobs per priority."""
+        return Counter(job.priority for job in self._pending)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.depth(),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent.copy(),
+            "wait_seconds": self.wait_time.copy(),
+        }
+
+    async def submit(self, chat_id, priority: int, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)`` for ``chat_id`` and await its result."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        job = OutboundJob(priority, next(self._seq), chat_id, func, args, kwargs, future)
+        self._pending.append(job)
+        self._wakeup.set()
+        return await future
+
+    def start(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.get_running_loop().create_task(self._dispatch())
+
+    async def stop(self) -> None:
+        """Stop dispatching and wait for the sends already started."""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for job in self._pending:
+            job.future.cancel()
+        self._pending.clear()
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+
+    def _get_chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > MAX_IDLE_BUCKETS:
+                now = time.monotonic()
+                for key, idle in list(self._chats.items()):
+                    idle.refill(now)
+                    if idle.tokens >= idle.capacity:
+                        del self._chats[key]
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _next_job(self, now: float):
+        """Return the best sendable job, or ``None`` and how long to wait for one."""
+        best = None
+        wait = None
+        for job in self._pending:
+            if job.future.cancelled():
+                continue
+            delay = self._get_chat_bucket(job.chat_id).delay(now)
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or (job.priority, job.seq) < (best.priority, best.seq):
+                best = job
+        return best, wait
+
+    async def _dispatch(self) -> None:
+        while True:
+            self._pending = [job for job in self._pending if not job.future.cancelled()]
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = time.monotonic()
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+                continue
+
+            job, wait = self._next_job(now)
+            if job is None:
+                # every queued chat is throttled, sleep until one refills or a job arrives
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._pending.remove(job)
+            self._global.take()
+            self._get_chat_bucket(job.chat_id).take()
+            self.sent[job.priority] += 1
+            self.wait_time[job.priority] += now - job.queued
+            task = asyncio.get_running_loop().create_task(self._send(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    @staticmethod
+    async def _send(job: OutboundJob) -> None:
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except asyncio.CancelledError:
+            job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+
+
+_outbox = None
+
+
+def get_outbox() -> Outbox:
+    """Return the process wide outbox."""
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox()
+        logging.info("Outbox rate: %s/s global, %s/s per chat", GLOBAL_RATE, CHAT_RATE)
+    return _outbox
+
+
+async def shutdown_outbox() -> None:
+    global _outbox
+    if _outbox is not None:
+        await _outbox.stop()
+        _outbox = None
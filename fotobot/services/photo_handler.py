@@ -1,215 +1,168 @@
-import logging
-
-import magic
-import uuid
+import asyncio
 import io
+import logging
 import math
-import pillow_avif
+from typing import Optional
 
-from PIL import Image
-from telegram import Update, constants
+from telegram import InputMediaPhoto, Update, constants
 from telegram.ext import ContextTypes
-from pillow_heif import register_heif_opener
-from config import PHOTO_PATH
 
 import os
-import fotobot.exif  # noqa: F401 - ensure workers are registered
-from fotobot.exif.exifworker import ExifWorker
-from fotobot.exif.base import get_worker as registry_get_worker
-from fotobot.exif.styles import Style, get_default_style, get_full_style, get_pretty_style
+from fotobot import metrics
+from fotobot.exif.styles import Style
 from fotobot.services.helper import (
-    remove_original_doc_from_server,
+    SEND_POLICY,
+    reply_location,
+    reply_media_group,
     reply_photo,
     reply_text,
 )
-from fotobot.services.image_service import (
-    download_file,
-    parse_metadata,
-    render_caption,
-    send_response,
+from fotobot.services import image_service
+from fotobot.services.admission import BusyError
+from fotobot.services.album import get_album_collector
+from fotobot.services.processing import (
+    MIME_SNIFF_SIZE,
+    UnsupportedFormatError,
+    check_mime,
+    sniff_mime,
 )
 
-SUPPORTED_MIME_LIST = (
-    "image/jpeg", "image/png", "image/heic",
-    "HEIF/heic", "HEIF/heix", "HEIF/hevc",
-    "HEIF/heim", "HEIF/heis", "HEIF/hevm", "HEIF/hevs",
-    "HEIF/avif"
+# Telegram does not let bots download larger files
+MAX_FILE_SIZE = 20 * 1024 * 1024
+# MIME types a client may declare for a supported upload, the content is sniffed anyway
+DECLARED_MIME_LIST = (
+    "image/jpeg", "image/png", "image/heic", "image/heif", "image/avif",
+    "image/heic-sequence", "image/heif-sequence", "application/octet-stream",
 )
-HEIF_MAPPING = {
-    "ftypheic": "HEIF/heic",
-    "ftypheix": "HEIF/heix",
-    "ftyphevc": "HEIF/hevc",
-    "ftypheim": "HEIF/heim",
-    "ftypheis": "HEIF/heis",
-    "ftyphevm": "HEIF/hevm",
-    "ftyphevs": "HEIF/hevs",
-    "ftypavif": "HEIF/avif",
-}
-MAX_IMAGE_DIM = 10000
-
-def get_worker(photo_path: str) -> ExifWorker:
-    """Return a worker instance based on the ``FOTOBOT_WORKER`` env var."""
-    name = os.getenv("FOTOBOT_WORKER", "pillow")
-    logging.info("Using %s backend...", name)
-    worker = registry_get_worker(name, photo_path)
-    if name == "pillow" and "Unknown" in worker.get_lens():
-        logging.info("Switch to ExifTool backend...")
-        worker = registry_get_worker("exiftool", photo_path)
-    return worker
-
-def get_description(worker: ExifWorker, template: str) -> str:
-    return worker.get_description(template)
-
-def get_coordinates(worker: ExifWorker) -> (float, float):
-    return worker.get_f_latitude_longitude()
-
-def get_orientation(worker: ExifWorker) -> int:
-    return worker.get_orientation()
-
-def get_template(worker: ExifWorker, style: int) -> str:
-    is_full_frame = worker.get_focal_length() == worker.get_focal_length_in_35mm() or worker.get_focal_length_in_35mm().startswith("Unknown")
-    # Deal with combo output by Exiftool
-    is_exposure_compensation = not worker.get_exposure_compensation().startswith("Unknown")
-    is_metering = not worker.get_metering_mode().startswith("Unknown")
-    is_author = not worker.get_author().startswith("Unknown")
-    is_title = worker.get_title() != ""
-    is_location = not worker.get_location().startswith("Unknown")
-    is_country = not worker.get_country().startswith("Unknown")
-    is_gps = not worker.get_latitude_longitude().startswith("Unknown")
-    is_keywords = not worker.get_keywords().startswith("Unknown")
-    is_special = worker.get_focal_length_in_35mm().endswith(')')
-    is_unknown = worker.get_aperture().startswith("Unknown") and worker.get_iso().startswith("Unknown") and worker.get_shutter_speed().startswith("Unknown")
-
-    if style == Style.FULL.value:
-        return get_full_style(
-            is_full_frame, is_exposure_compensation, is_metering,
-            is_author, is_title, is_country, is_location, is_gps,
-            is_keywords
-        )
-    elif style == Style.PRETTY.value:
-        return get_pretty_style(is_full_frame, is_unknown, is_country, is_location, is_title, is_gps)
-
-    return get_default_style(is_full_frame, is_special, is_unknown, is_country, is_location, is_title, is_gps)
-
-
-def img_resize(photo_path: str, orientation=1) -> Image.Image:
-    img = Image.open(photo_path)
-    w, h = img.size
-    w_max = MAX_IMAGE_DIM * w // (w+h)
-    h_max = MAX_IMAGE_DIM - w_max
-    logging.info("Image size: width=%s, height=%s", w, h)
-    logging.info("Max Image size: width=%s, height=%s", w_max, h_max)
-
-    img = img.resize((min(w_max, w), min(h_max, h)), Image.Resampling.LANCZOS)
-    
-    if orientation == 3:
-        img = img.rotate(180, expand=True)
-    elif orientation == 6:
-        img = img.rotate(270, expand=True)
-    elif orientation== 8:
-        img = img.rotate(90, expand=True)
-
-    return img
-
-def img_to_bytes(image: Image) -> bytes:
-    b_img = io.BytesIO()
-    image.save(b_img, format="JPEG")
-    b_img = b_img.getvalue()
-    return b_img
-
-def get_mime(photo_path: str) -> str:
-    mime_guesser = magic.Magic(mime=True)
-    mimetype = mime_guesser.from_file(photo_path)
-
-    if mimetype == "application/octet-stream":
-        with open(photo_path, 'rb') as f:
-            f.read(4)
-            b_signature = f.read(8)
-            signature = b_signature.decode('utf-8')
-            if signature in HEIF_MAPPING.keys():
-                mimetype = HEIF_MAPPING[signature]
-    
-    return mimetype if mimetype else "Unknown"
+# "disk" downloads uploads to PHOTO_PATH, "memory" keeps them in a buffer
+PIPELINE = os.getenv("FOTOBOT_PIPELINE", "disk")
+
+def validate_upload(update: Update) -> None:
+    """Refuse uploads whose declared size or MIME type rules them out before downloading."""
+    document = update.message.effective_attachment
+    file_size = getattr(document, "file_size", None)
+    if file_size is not None and file_size > MAX_FILE_SIZE:
+        raise IOError(f"File too large: {file_size} bytes")
+    mimetype = getattr(document, "mime_type", None)
+    if mimetype is not None and mimetype not in DECLARED_MIME_LIST:
+        raise UnsupportedFormatError(mimetype)
+
+def write_file(photo_path: str, data: bytes) -> None:
+    with open(photo_path, "wb") as f:
+        f.write(data)
 
 async def download_image(update: Update, photo_path: str) -> None:
+    data = await download_image_to_memory(update)
+    # up to MAX_FILE_SIZE, too much to write on the event loop
+    await asyncio.to_thread(write_file, photo_path, data)
+
+async def download_image_to_memory(update: Update) -> bytes:
+    async def download(photo_file) -> bytes:
+        buffer = io.BytesIO()
+        await photo_file.download_to_memory(buffer)
+        return buffer.getvalue()
+
     try:
-        photo_file = await update.message.effective_attachment.get_file()
-        await photo_file.download_to_drive(photo_path)
+        photo_file = await SEND_POLICY.run(update.message.effective_attachment.get_file)
+        data = await SEND_POLICY.run(download, photo_file)
     except Exception as _:
         raise IOError from _
-
-def check_mime(mimetype: str) -> None:
-    try:
-        if mimetype not in SUPPORTED_MIME_LIST:
-            raise TypeError
-        if mimetype == "image/heic" or mimetype.startswith("HEIF"):
-            register_heif_opener()
-    except TypeError as _:
-        raise TypeError from _
-
-async def send_msg(update: Update, photo_path: str, caption: str, parse_mode: str, coordinates=None, img_orientation=None) -> None:
-    if caption[-1] != "!":
-        if img_orientation is not None:
-            img_orientation = 1
-        img = img_resize(photo_path, img_orientation)
-        b_img = img_to_bytes(img)
-        await reply_photo(
+    # refuse unsupported content before anything is written to disk
+    check_mime(sniff_mime(data[:MIME_SNIFF_SIZE]))
+    return data
+
+async def send_location(update: Update, coordinates) -> None:
+    if coordinates is not None:
+        lat, lon = coordinates
+        if lat and lon and not math.isnan(lat) and not math.isnan(lon):
+            await reply_location(update, lat, lon)
+
+async def send_msg(update: Update, photo, caption: str, parse_mode: str, coordinates=None) -> Optional[str]:
+    file_id = None
+    if photo is not None:
+        message = await reply_photo(
             update=update,
-            photo=b_img,
+            photo=photo,
             caption=caption,
             parse_mode=parse_mode
         )
-        if coordinates is not None:
-            lat, lon = coordinates
-            if lat and lon and not math.isnan(lat) and not math.isnan(lon):
-                await update.message.reply_location(latitude=lat, longitude=lon)
+        if message is not None and message.photo:
+            file_id = message.photo[-1].file_id
+        await send_location(update, coordinates)
     else:
         await reply_text(
             update=update,
             text=caption,
             parse_mode=parse_mode
         )
+    return file_id
+
+async def send_media_group(update: Update, items: list, parse_mode: str) -> list:
+    """Send ``(photo, caption)`` pairs as one album, return the ``file_id`` of each photo."""
+    media = [InputMediaPhoto(photo, caption=caption, parse_mode=parse_mode) for photo, caption in items]
+    messages = await reply_media_group(update, media)
+    if messages is None:
+        return [None] * len(items)
+    return [message.photo[-1].file_id if message.photo else None for message in messages]
+
+def get_error_reply(e: Exception) -> (str, str):
+    """Return the error kind counted in metrics and the reply for a failed photo."""
+    if isinstance(e, BusyError):
+        return "busy", "Too many photos at once! Please try again in a minute."
+    if isinstance(e, IOError):
+        return "download", "Cannot download file! (Max File Size: 20MB) Please try again."
+    if isinstance(e, UnsupportedFormatError):
+        mimetype = e.args[0] if e.args else "Unknown"
+        if mimetype == 'Unknown':
+            return "mimetype", "Unknown file type!"
+        return "mimetype", f"{mimetype} not supported!"
+    return "parse", "Cannot parse EXIF data!"
+
+async def album_handler(update: Update, style: int) -> None:
+    """Handle an album once all of its items arrived, ``update`` being its first item."""
+    timer = metrics.StageTimer()
+    try:
+        updates = await get_album_collector().collect(update.message.media_group_id)
+        logging.info("Album of %s photos, Output Style %s...", len(updates), Style(style).name)
+        with timer.stage("album"):
+            results = await image_service.process_album(updates, style)
+            await image_service.send_album(updates, results)
+        timer.observe(style=Style(style).name)
+    except Exception as e:
+        # failures of single items are replied to by send_album, this one
+        # is for the whole album and runs in a task nobody awaits
+        kind, description = get_error_reply(e)
+        metrics.ERRORS.inc(kind=kind)
+        logging.error(description)
+        logging.error(e.args)
+        await reply_text(update, description, constants.ParseMode.HTML)
 
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, style: int) -> None:
-    logger = logging.getLogger(__name__)
     logging.info("photo_handler started")
-    user = update.message.from_user
+    if update.message.media_group_id is not None:
+        # the first item handles the whole album in the background, later
+        # items must not wait for it or they would block their own delivery
+        if get_album_collector().add(update):
+            context.application.create_task(album_handler(update, style), update=update)
+        return
 
-    photo_path = f"{PHOTO_PATH}/{uuid.uuid4()}_img"
     parse_mode = constants.ParseMode.HTML
-    description = ""
-    coordinates = None
-    orientation = None
 
+    timer = metrics.StageTimer()
     try:
-        await download_file(update, photo_path)
-        logging.info("Download completed from user %s", user.full_name)
-
         logging.info("Parsing EXIF data...")
-        worker, mimetype = parse_metadata(photo_path)
-        logging.info("File MIME type: %s", mimetype)
         logging.info("Output Style %s...", Style(style).name)
-        description, coordinates, orientation = render_caption(worker, style)
-        await send_response(update, photo_path, description, coordinates, orientation)
-        remove_original_doc_from_server(photo_path, logger)
-    except IOError as e:
-        description = "Cannot download file! (Max File Size: 20MB) Please try again."
-        logging.error(description)
-        logging.error(e.args)
-        await reply_text(update, description, parse_mode)
-    except TypeError as e:
-        if mimetype == 'Unknown':
-            description = "Unknown file type!"
-        else:
-            description = f"{mimetype} not supported!"
-        logging.error(description)
-        logging.error(e.args)
-        await reply_text(update, description, parse_mode)
-        remove_original_doc_from_server(photo_path, logger)
+        result = await image_service.get_result(update, style, timer)
+        mimetype = result.mimetype
+        logging.info("File MIME type: %s", mimetype)
+        with timer.stage("upload"):
+            file_id = await image_service.send_response(update, result.photo, result.caption, result.coordinates)
+        image_service.remember_upload(update, file_id)
+        timer.observe(backend=result.backend, mimetype=mimetype, style=Style(style).name)
     except Exception as e:
-        description = "Cannot parse EXIF data!"
+        kind, description = get_error_reply(e)
+        metrics.ERRORS.inc(kind=kind)
         logging.error(description)
         logging.error(e.args)
         await reply_text(update, description, parse_mode)
-        remove_original_doc_from_server(photo_path, logger)
 
@@ -0,0 +1,134 @@
+"""Content-addressed on-disk cache of encoded preview JPEGs.
+
+Entries are plain files named after a hash of the upload's bytes and the
+render settings, so every worker process can share the directory. Writes go
+to a temporary file that is renamed into place, readers therefore see either
+a complete preview or none. The modification time of an entry is bumped on
+every hit and serves as the LRU index when trimming to the byte budget.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+CACHE_DIR = os.getenv("FOTOBOT_PREVIEW_CACHE_DIR", "preview_cache")
+# 0 disables the cache
+MAX_BYTES = int(os.getenv("FOTOBOT_PREVIEW_CACHE_BYTES", str(256 * 1024 * 1024)))
+# trim after this share of the budget has been written by one process
+TRIM_FRACTION = 0.1
+# entries are kept below this share of the budget after a trim
+TRIM_TARGET = 0.9
+SUFFIX = ".jpg"
+
+
+class PreviewCache:
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = MAX_BYTES) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # trim on the first write to account for what earlier runs left
+        self._written = max_bytes
+
+    @staticmethod
+    def key(digest: str, *params) -> str:
+        """Entry name for content ``digest`` rendered with ``params``."""
+        return hashlib.sha256(f"{digest}:{params!r}".encode()).hexdigest()
+
+    def get_path(self, key: str) -> str:
+        # fan out so no single directory grows too large
+        return os.path.join(self.directory, key[:2], key + SUFFIX)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self.get_path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # trimmed by another process in between, the data read is still whole
+            pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._written += len(data)
+        if self._written >= self.max_bytes * TRIM_FRACTION:
+            self.trim()
+
+    def scan(self) -> list:
+        """Return (access time, size, path) of every entry."""
+        entries = []
+        try:
+            subdirs = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return entries
+        for subdir in subdirs:
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.endswith(SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def trim(self) -> None:
+        """Remove least recently used entries until the cache fits its budget."""
+        self._written = 0
+        entries = self.scan()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        started = time.perf_counter()
+        target = self.max_bytes * TRIM_TARGET
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        logging.info("Trimmed %s previews in %.3fs", removed, time.perf_counter() - started)
+
+
+_cache = None
+_enabled = bool(MAX_BYTES)
+
+
+def get_preview_cache() -> Optional[PreviewCache]:
+    """Return the cache, or ``None`` when it is disabled."""
+    global _cache
+    if not _enabled:
+        return None
+    if _cache is None:
+        _cache = PreviewCache()
+    return _cache
+
+
+def set_preview_cache(cache: Optional[PreviewCache]) -> None:
+    """Use ``cache`` in this process instead of the configured one, ``None`` disables caching."""
+    global _cache, _enabled
+    _cache = cache
+    _enabled = cache is not None
@@ -0,0 +1,433 @@
+"""Telegram independent stages of the photo pipeline: detection, parsing,
+captioning and rendering of the preview.
+
+Shared by the bot and the offline batch command, so nothing here may import
+``telegram`` or the bot's ``config``.
+"""
+
+import io
+import logging
+import os
+from string import Template
+from typing import Optional
+
+from PIL import ExifTags, Image
+
+import fotobot.exif  # noqa: F401 - registers the workers, imported on first use
+from fotobot import metrics
+from fotobot.exif.base import get_worker as registry_get_worker
+from fotobot.exif.exifworker import ExifWorker
+from fotobot.exif.heif import register_plugins
+from fotobot.exif.metadata import PhotoMetadata
+from fotobot.exif.source import PhotoSource, as_source
+from fotobot.exif.styles import Style, get_compiled_template
+from fotobot.services import admission
+from fotobot.services.preview_cache import get_preview_cache
+
+class UnsupportedFormatError(TypeError):
+    """An upload of a type the bot can't read, ``args[0]`` is its MIME type."""
+
+
+SUPPORTED_MIME_LIST = (
+    "image/jpeg", "image/png", "image/heic",
+    "HEIF/heic", "HEIF/heix", "HEIF/hevc",
+    "HEIF/heim", "HEIF/heis", "HEIF/hevm", "HEIF/hevs",
+    "HEIF/avif"
+)
+HEIF_MAPPING = {
+    "ftypheic": "HEIF/heic",
+    "ftypheix": "HEIF/heix",
+    "ftyphevc": "HEIF/hevc",
+    "ftypheim": "HEIF/heim",
+    "ftypheis": "HEIF/heis",
+    "ftyphevm": "HEIF/hevm",
+    "ftyphevs": "HEIF/hevs",
+    "ftypavif": "HEIF/avif",
+}
+MAX_IMAGE_DIM = 10000
+# "quality" resizes the fully decoded image, "speed" uses JPEG draft mode and
+# reducing_gap and caps previews at PREVIEW_MAX_SIDE
+RESIZE_MODE = os.getenv("FOTOBOT_RESIZE_MODE", "quality")
+# longest side Telegram keeps for photos
+PREVIEW_MAX_SIDE = 2560
+# lossless transposition for each EXIF orientation that needs one
+ORIENTATION_TRANSPOSE = {
+    3: Image.Transpose.ROTATE_180,
+    6: Image.Transpose.ROTATE_270,
+    8: Image.Transpose.ROTATE_90,
+}
+# Telegram refuses photos above 10 MB, previews are encoded to stay below
+JPEG_MAX_BYTES = int(os.getenv("FOTOBOT_JPEG_MAX_BYTES", str(10 * 1000 * 1000)))
+# first quality tried, lowered only when the preview does not fit
+JPEG_QUALITY = int(os.getenv("FOTOBOT_JPEG_QUALITY", "75"))
+JPEG_MIN_QUALITY = 30
+# encodes spent searching for a fitting quality after the first guess
+JPEG_MAX_TRIES = 4
+# progressive scans pay off on large previews only
+PROGRESSIVE_MIN_PIXELS = 1000 * 1000
+# send baseline JPEGs that already fit Telegram's limits as they are
+PASSTHROUGH = os.getenv("FOTOBOT_PASSTHROUGH", "1") == "1"
+# metadata removed from passed through JPEGs: "exif" drops EXIF, XMP and IPTC
+# like a re-encode would, "gps" only the location, "none" keeps everything
+PASSTHROUGH_STRIP = os.getenv("FOTOBOT_PASSTHROUGH_STRIP", "exif")
+# bytes searched for the JPEG frame header, metadata segments come before it
+JPEG_HEADER_SIZE = 256 * 1024
+# bytes read from the start of an upload to detect its type
+MIME_SNIFF_SIZE = 8192
+# (offset, signature, mimetype) checked before falling back to libmagic
+SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+) + tuple((4, brand.encode(), mimetype) for brand, mimetype in HEIF_MAPPING.items())
+
+def get_worker(photo_path: str) -> ExifWorker:
+    """Return a worker instance based on the ``FOTOBOT_WORKER`` env var."""
+    name = os.getenv("FOTOBOT_WORKER", "pillow")
+    logging.info("Using %s backend...", name)
+    worker = registry_get_worker(name, photo_path)
+    if name == "pillow" and "Unknown" in worker.get_lens():
+        logging.info("Switch to ExifTool backend...")
+        metrics.EXIFTOOL_FALLBACKS.inc()
+        worker = registry_get_worker("exiftool", photo_path)
+    return worker
+
+def get_workers(photo_paths: list) -> list:
+    """:func:`get_worker` for an album, with one exiftool run for all fallbacks.
+
+    Photos whose exiftool run failed get the exception instead of a worker.
+    """
+    name = os.getenv("FOTOBOT_WORKER", "pillow")
+    if name != "pillow":
+        return [get_worker(photo_path) for photo_path in photo_paths]
+    logging.info("Using %s backend for %s photos...", name, len(photo_paths))
+    workers = [registry_get_worker(name, photo_path) for photo_path in photo_paths]
+    fallbacks = [i for i, worker in enumerate(workers) if "Unknown" in worker.get_lens()]
+    if fallbacks:
+        logging.info("Switch %s photos to ExifTool backend...", len(fallbacks))
+        metrics.EXIFTOOL_FALLBACKS.inc(len(fallbacks))
+        from fotobot.exif.exiftoolworker import get_metadata_batch
+        try:
+            batch = get_metadata_batch([photo_paths[i] for i in fallbacks])
+        except Exception as e:
+            batch = [e] * len(fallbacks)
+        for i, exiftool_metadata in zip(fallbacks, batch):
+            if isinstance(exiftool_metadata, Exception):
+                workers[i] = exiftool_metadata
+            else:
+                workers[i] = registry_get_worker("exiftool", photo_paths[i], exiftool_metadata)
+    return workers
+
+def get_description(metadata: PhotoMetadata, template: Template) -> str:
+    return metadata.get_description(template)
+
+def get_coordinates(metadata: PhotoMetadata) -> (float, float):
+    return metadata.latitude, metadata.longitude
+
+def get_orientation(metadata: PhotoMetadata) -> int:
+    return metadata.orientation
+
+def get_template(metadata: PhotoMetadata, style: int) -> Template:
+    is_full_frame = metadata.focal_length == metadata.focal_length_in_35mm or metadata.focal_length_in_35mm.startswith("Unknown")
+    # Deal with combo output by Exiftool
+    is_exposure_compensation = not metadata.exposure_compensation.startswith("Unknown")
+    is_metering = not metadata.metering_mode.startswith("Unknown")
+    is_author = not metadata.author.startswith("Unknown")
+    is_title = metadata.title != ""
+    is_location = not metadata.location.startswith("Unknown")
+    is_country = not metadata.country.startswith("Unknown")
+    is_gps = not metadata.gps_coordinates.startswith("Unknown")
+    is_keywords = not metadata.keywords.startswith("Unknown")
+    is_special = metadata.focal_length_in_35mm.endswith(')')
+    is_unknown = metadata.aperture.startswith("Unknown") and metadata.iso.startswith("Unknown") and metadata.shutter_speed.startswith("Unknown")
+
+    if style == Style.FULL.value:
+        return get_compiled_template(
+            Style.FULL, is_full_frame, is_exposure_compensation, is_metering,
+            is_author, is_title, is_country, is_location, is_gps,
+            is_keywords
+        )
+    elif style == Style.PRETTY.value:
+        return get_compiled_template(Style.PRETTY, is_full_frame, is_unknown, is_country, is_location, is_title, is_gps)
+
+    return get_compiled_template(Style.DEFAULT, is_full_frame, is_special, is_unknown, is_country, is_location, is_title, is_gps)
+
+
+def get_target_size(w: int, h: int, mode: str = RESIZE_MODE) -> (int, int):
+    w_max = MAX_IMAGE_DIM * w // (w+h)
+    h_max = MAX_IMAGE_DIM - w_max
+    logging.info("Max Image size: width=%s, height=%s", w_max, h_max)
+    size = (min(w_max, w), min(h_max, h))
+    if mode == "speed":
+        scale = PREVIEW_MAX_SIDE / max(size)
+        if scale < 1:
+            size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+    return size
+
+def get_decoded_size(photo_path, mode: str = RESIZE_MODE) -> int:
+    """Bytes :func:`img_resize` allocates for the upload, read from its header."""
+    if isinstance(photo_path, PhotoSource):
+        img = photo_path.image
+        w, h, img_mode = *img.size, img.mode
+    else:
+        with Image.open(photo_path) as img:
+            w, h, img_mode = *img.size, img.mode
+    # Pillow stores pixels of three or more bands and 32 bit ones in 4 bytes
+    bands = Image.getmodebands(img_mode)
+    pixel_size = 4 if bands > 1 or img_mode in ("I", "F") else 2 if img_mode.startswith("I;16") else 1
+    nbytes = w * h * pixel_size
+    if img_mode in ("P", "1"):
+        # expanded to RGB or RGBA before resizing
+        nbytes += w * h * 4
+    target_w, target_h = get_target_size(w, h, mode)
+    return nbytes + target_w * target_h * 4
+
+def img_resize(photo_path, orientation=1, mode: str = RESIZE_MODE) -> Image.Image:
+    img = photo_path.image if isinstance(photo_path, PhotoSource) else Image.open(photo_path)
+    if img.format == "HEIF":
+        # libheif applies the rotation while decoding, the EXIF tag read
+        # from the file would turn the image a second time
+        orientation = 1
+    w, h = img.size
+    logging.info("Image size: width=%s, height=%s", w, h)
+    size = get_target_size(w, h, mode)
+    if img.mode in ("P", "1"):
+        # palette images would be resized with NEAREST, expand them first
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+
+    if mode == "speed":
+        # Let the JPEG decoder downscale by 1/2, 1/4 or 1/8 in the DCT domain, then
+        # shrink by an integer factor before the final LANCZOS pass
+        if img.im is None:
+            img.draft(img.mode, size)
+        img = img.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    else:
+        img = img.resize(size, Image.Resampling.LANCZOS)
+
+    if orientation in ORIENTATION_TRANSPOSE:
+        img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+
+    return img
+
+def normalize_mode(image: Image.Image) -> Image.Image:
+    """Convert ``image`` to a mode JPEG can hold, flattening transparency onto white."""
+    if image.mode in ("RGB", "L"):
+        return image
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode in ("I;16", "I", "F"):
+        # 16 bit and float greyscale, scale into 8 bits instead of clipping
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 1
+        return image.convert("F").point(lambda v: (v - low) * scale).convert("L")
+    return image.convert("RGB")
+
+def encode_jpeg(image: Image.Image, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    image.save(
+        buffer,
+        format="JPEG",
+        quality=quality,
+        # chroma at full resolution only pays off at high qualities
+        subsampling=0 if quality >= 90 else 2,
+        progressive=image.width * image.height >= PROGRESSIVE_MIN_PIXELS,
+    )
+    # a BytesIO nobody else holds hands its bytes over without a copy
+    return buffer.getvalue()
+
+def img_to_bytes(image: Image, max_bytes: int = JPEG_MAX_BYTES, quality: int = JPEG_QUALITY) -> bytes:
+    """Encode ``image`` as JPEG at ``quality``, or lower when that exceeds ``max_bytes``.
+
+    The lower quality is found by a bounded binary search that starts from
+    the size of the first encode.
+    """
+    image = normalize_mode(image)
+    data = encode_jpeg(image, quality)
+    if not max_bytes or len(data) <= max_bytes:
+        return data
+
+    best = None
+    current = quality
+    low, high = JPEG_MIN_QUALITY, quality - 1
+    # size grows roughly linearly with quality in the usual range
+    guess = int(quality * max_bytes / len(data))
+    for _ in range(JPEG_MAX_TRIES):
+        if low > high:
+            break
+        current = min(max(guess, low), high)
+        data = encode_jpeg(image, current)
+        if len(data) <= max_bytes:
+            best = data
+            low = current + 1
+        else:
+            high = current - 1
+        guess = (low + high) // 2
+    if best is None:
+        logging.warning("Preview exceeds %s bytes even at quality %s", max_bytes, current)
+        if current != JPEG_MIN_QUALITY:
+            data = encode_jpeg(image, JPEG_MIN_QUALITY)
+        best = data
+    return best
+
+def iter_jpeg_segments(data: bytes):
+    """Yield ``(marker, start, end)`` of the segments before the scan data.
+
+    Stops at the start of scan, or where ``data`` ends or stops looking like a JPEG.
+    """
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # fill byte
+            pos += 1
+            continue
+        end = pos + 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+        yield marker, pos, end
+        if marker == 0xDA:
+            return
+        pos = end
+
+def get_jpeg_frame(head: bytes):
+    """Return ``(SOF marker, width, height, components)`` from the start of a JPEG."""
+    if not head.startswith(b"\xff\xd8"):
+        return None
+    for marker, start, end in iter_jpeg_segments(head):
+        # SOF0 to SOF15 except DHT, JPG and DAC which share the range
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC) and start + 10 <= len(head):
+            height = int.from_bytes(head[start + 5:start + 7], "big")
+            width = int.from_bytes(head[start + 7:start + 9], "big")
+            return marker, width, height, head[start + 9]
+    return None
+
+def strip_jpeg_metadata(data: bytes, strip: str = PASSTHROUGH_STRIP) -> bytes:
+    """Drop metadata segments of a JPEG without touching the scan data."""
+    if strip == "none":
+        return data
+    parts = [data[:2]]
+    scan_start = 2
+    for marker, start, end in iter_jpeg_segments(data):
+        scan_start = start if marker == 0xDA else end
+        if marker == 0xDA:
+            break
+        segment = data[start:end]
+        payload = segment[4:]
+        if marker == 0xE1 and payload.startswith(b"Exif\x00\x00"):
+            if strip == "gps":
+                segment = remove_gps(payload)
+            else:
+                segment = b""
+        elif (marker == 0xE1 and payload.startswith(b"http://ns.adobe.com/xap/")) or marker == 0xED:
+            # XMP and Photoshop IPTC may repeat the location
+            segment = b""
+        parts.append(segment)
+    parts.append(data[scan_start:])
+    return b"".join(parts)
+
+def remove_gps(exif_payload: bytes) -> bytes:
+    """APP1 segment rebuilt from ``exif_payload`` without the GPS IFD."""
+    exif = Image.Exif()
+    exif.load(exif_payload)
+    if ExifTags.Base.GPSInfo not in exif:
+        payload = exif_payload
+    else:
+        # loading the sub IFD makes tobytes write it back out
+        exif.get_ifd(ExifTags.Base.ExifOffset)
+        del exif[ExifTags.Base.GPSInfo]
+        payload = exif.tobytes()
+    return b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+
+def get_passthrough(photo_path, orientation, mode: str = RESIZE_MODE) -> Optional[bytes]:
+    """The upload's own bytes when they can be sent without re-encoding, else ``None``.
+
+    Only baseline RGB or greyscale JPEGs that need no rotation, no resize and
+    fit the byte budget qualify; the decision is made from the header alone.
+    """
+    source = as_source(photo_path)
+    frame = get_jpeg_frame(source.head(JPEG_HEADER_SIZE))
+    if frame is None or orientation not in (None, 1):
+        return None
+    marker, width, height, components = frame
+    if marker != 0xC0 or components not in (1, 3) or get_target_size(width, height, mode) != (width, height):
+        return None
+    size = len(source.data) if source.data is not None else os.path.getsize(source.path)
+    if JPEG_MAX_BYTES and size > JPEG_MAX_BYTES:
+        return None
+    if source.data is not None:
+        data = source.data
+    else:
+        with open(source.path, "rb") as f:
+            data = f.read()
+    return strip_jpeg_metadata(data)
+
+def wants_photo(caption: str) -> bool:
+    """Captions ending with "!" are sent as text only."""
+    return caption[-1] != "!"
+
+def render_photo(photo_path, caption: str, img_orientation=None) -> Optional[bytes]:
+    """Resize and encode the upload, or return ``None`` for text-only replies."""
+    if not wants_photo(caption):
+        return None
+    if PASSTHROUGH:
+        data = get_passthrough(photo_path, img_orientation)
+        if data is not None:
+            metrics.PASSTHROUGHS.inc()
+            return data
+    cache = get_preview_cache()
+    if cache is not None:
+        with metrics.stage("preview_cache"):
+            key = cache.key(as_source(photo_path).digest(), img_orientation, RESIZE_MODE,
+                            JPEG_QUALITY, JPEG_MAX_BYTES)
+            try:
+                data = cache.get(key)
+            except OSError as e:
+                logging.warning("Cannot read the preview cache: %s", e)
+                data = None
+        metrics.CACHE_EVENTS.inc(cache="preview", result="miss" if data is None else "hit")
+        if data is not None:
+            return data
+    with admission.reserve(get_decoded_size(photo_path)):
+        with metrics.stage("resize"):
+            img = img_resize(photo_path, img_orientation)
+        if isinstance(photo_path, PhotoSource):
+            # give the full size pixels back before the next decode is admitted
+            photo_path.release_image()
+        with metrics.stage("encode"):
+            data = img_to_bytes(img)
+        del img
+    if cache is not None:
+        try:
+            cache.put(key, data)
+        except OSError as e:
+            # a full or read-only cache must not cost the user the preview
+            logging.warning("Cannot write the preview cache: %s", e)
+    return data
+
+_mime_guesser = None
+
+def get_mime_guesser():
+    """libmagic instance shared by every call in this process."""
+    global _mime_guesser
+    if _mime_guesser is None:
+        # most uploads are recognized by SIGNATURES without ever loading libmagic
+        import magic
+        _mime_guesser = magic.Magic(mime=True)
+    return _mime_guesser
+
+def sniff_mime(head: bytes) -> str:
+    for offset, signature, mimetype in SIGNATURES:
+        if head.startswith(signature, offset):
+            return mimetype
+    mimetype = get_mime_guesser().from_buffer(head)
+    return mimetype if mimetype else "Unknown"
+
+def get_mime(photo_path) -> str:
+    return sniff_mime(as_source(photo_path).head(MIME_SNIFF_SIZE))
+
+def check_mime(mimetype: str) -> None:
+    if mimetype not in SUPPORTED_MIME_LIST:
+        raise UnsupportedFormatError(mimetype)
+    if mimetype == "image/heic" or mimetype.startswith("HEIF"):
+        # normally done once by the pool initializer already
+        register_plugins()
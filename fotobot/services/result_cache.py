@@ -0,0 +1,89 @@
+"""Cache of processed uploads keyed by Telegram's ``file_unique_id``."""
+
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+MAX_SIZE = int(os.getenv("FOTOBOT_RESULT_CACHE_SIZE", "1024"))
+TTL = float(os.getenv("FOTOBOT_RESULT_CACHE_TTL", str(24 * 3600)))
+
+
+class ResultCache:
+    """LRU of at most ``max_size`` entries that expire after ``ttl`` seconds.
+
+    :meth:`run_once` makes concurrent callers for the same key share a single
+    computation. Only used from the event loop, so there is no locking.
+    """
+
+    def __init__(self, max_size: int = MAX_SIZE, ttl: float = TTL) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, created = entry
+        if time.monotonic() - created >= self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        self._entries[key] = (value, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def update(self, key, **fields) -> None:
+        """``_replace`` ``fields`` on the cached tuple, keeping its age."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, created = entry
+            self._entries[key] = (value._replace(**fields), created)
+
+    async def run_once(self, key, func, *args) -> (object, bool):
+        """Await ``func(*args)``, or join the call already running for ``key``.
+
+        Returns the result and whether it was shared with an earlier caller.
+        """
+        future = self._in_flight.get(key)
+        if future is not None:
+            # shielded so a cancelled waiter does not cancel the shared call
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        # nobody may be waiting, don't warn about an unretrieved exception
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[key] = future
+        try:
+            result = await func(*args)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            del self._in_flight[key]
+
+
+_cache: Optional[ResultCache] = None
+
+
+def get_result_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
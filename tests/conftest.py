@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import types
+
+# keep the tests away from the caches and databases of a running bot,
+# the settings are read when the modules are imported
+_tmp = tempfile.mkdtemp(prefix="fotobot_tests_")
+os.environ.setdefault("FOTOBOT_GEOCODE_DB", os.path.join(_tmp, "geocode.sqlite3"))
+os.environ.setdefault("FOTOBOT_PREVIEW_CACHE_DIR", os.path.join(_tmp, "preview_cache"))
+os.environ.setdefault("FOTOBOT_STATE_DB", os.path.join(_tmp, "state.sqlite3"))
+
+# the bot's modules read config.py, which is not part of the repository
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType("config")
+    config.TOKEN = "123:test"
+    config.LOGGING_LEVEL = "WARNING"
+    config.PHOTO_PATH = _tmp
+    sys.modules["config"] = config
+
+import pytest  # noqa: E402
+from PIL import Image  # noqa: E402
+
+from benchmarks.corpus import make_exif, make_pixels  # noqa: E402
+from fotobot import metrics  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.drain()
+    yield
+    metrics.drain()
+
+
+@pytest.fixture
+def make_photo(tmp_path):
+    """Write a small photo with camera and lens EXIF, return its path."""
+    def make(name="photo.jpg", size=(96, 64), orientation=1, variant="exif", format=None, **params):
+        path = str(tmp_path / name)
+        img = make_pixels(size)
+        if variant is not None:
+            params["exif"] = make_exif(variant, orientation)
+        img.save(path, format=format, **params)
+        return path
+    return make
+
+
+def open_size(data: bytes) -> (int, int):
+    """Dimensions of an encoded image."""
+    import io
+    with Image.open(io.BytesIO(data)) as img:
+        return img.size
@@ -0,0 +1,100 @@
+import threading
+import time
+
+import pytest
+
+from fotobot import metrics
+from fotobot.services import admission
+from fotobot.services.admission import BusyError, DecodeBudget
+
+
+def test_reserve_and_release():
+    budget = DecodeBudget(max_bytes=100, wait=0)
+    with budget.reserve(60):
+        assert budget.used == 60
+        with budget.reserve(40):
+            assert budget.used == 100
+    assert budget.used == 0
+
+
+def test_busy_when_the_budget_stays_used():
+    budget = DecodeBudget(max_bytes=100, wait=0.05)
+    with budget.reserve(60):
+        with pytest.raises(BusyError):
+            with budget.reserve(50):
+                pass
+        assert budget.used == 60
+    assert metrics.ADMISSIONS.values == {("admitted",): 1, ("busy",): 1}
+
+
+def test_waits_for_a_release():
+    budget = DecodeBudget(max_bytes=100, wait=5)
+    admitted = threading.Event()
+    holding = threading.Event()
+
+    def hold():
+        with budget.reserve(80):
+            holding.set()
+            time.sleep(0.05)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait()
+    with budget.reserve(80):
+        admitted.set()
+        assert budget.used == 80
+    thread.join()
+    assert admitted.is_set()
+
+
+def test_oversized_decode_runs_alone():
+    budget = DecodeBudget(max_bytes=100, wait=0.05)
+    with budget.reserve(1000):
+        assert budget.used == 100
+        with pytest.raises(BusyError):
+            with budget.reserve(1):
+                pass
+    with budget.reserve(1000):
+        pass
+
+
+def test_released_on_error():
+    budget = DecodeBudget(max_bytes=100, wait=0)
+    with pytest.raises(ValueError):
+        with budget.reserve(100):
+            raise ValueError
+    assert budget.used == 0
+
+
+def test_module_reserve_without_budget():
+    admission.set_budget(None)
+    with admission.reserve(10 ** 12):
+        pass
+    budget = DecodeBudget(max_bytes=100, wait=0)
+    admission.set_budget(budget)
+    try:
+        with admission.reserve(30):
+            assert budget.used == 30
+    finally:
+        admission.set_budget(None)
+
+
+def test_render_waits_for_the_budget(make_photo):
+    from fotobot.services import processing
+    from fotobot.services.preview_cache import get_preview_cache, set_preview_cache
+
+    # rotated, so it can't be passed through without a decode
+    path = make_photo(size=(300, 200), orientation=6)
+    budget = DecodeBudget(max_bytes=processing.get_decoded_size(path), wait=0.05)
+    admission.set_budget(budget)
+    cache = get_preview_cache()
+    set_preview_cache(None)
+    try:
+        with budget.reserve(1):
+            with pytest.raises(BusyError):
+                processing.render_photo(path, "caption", 6)
+        assert processing.render_photo(path, "caption", 6)
+        assert budget.used == 0
+    finally:
+        admission.set_budget(None)
+        set_preview_cache(cache)
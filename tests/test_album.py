@@ -0,0 +1,27 @@
+import asyncio
+from types import SimpleNamespace
+
+from fotobot.services.album import AlbumCollector
+
+
+def make_update(media_group_id, message_id):
+    return SimpleNamespace(message=SimpleNamespace(media_group_id=media_group_id, message_id=message_id))
+
+
+def test_album_is_collected_once_quiet():
+    async def main():
+        collector = AlbumCollector(wait=0.05)
+        assert collector.add(make_update("g", 2))
+        collect = asyncio.create_task(collector.collect("g"))
+        await asyncio.sleep(0.03)
+        # late items extend the wait and arrive out of order
+        assert not collector.add(make_update("g", 1))
+        assert not collector.add(make_update("g", 3))
+        assert collector.add(make_update("other", 4))
+        await asyncio.sleep(0.03)
+        assert not collect.done()
+        updates = await collect
+        assert [u.message.message_id for u in updates] == [1, 2, 3]
+        assert list(collector._albums) == ["other"]
+
+    asyncio.run(main())
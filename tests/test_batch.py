@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+
+from fotobot import batch
+from fotobot.services import preview_cache
+
+
+def run_batch(root, out, **options):
+    args = argparse.Namespace(root=str(root), out=str(out), style="default", previews=None,
+                              preview_cache=None, workers=2, chunksize=1, resume=False)
+    for name, value in options.items():
+        setattr(args, name, value)
+    failures = batch.run(args)
+    records = {}
+    with open(out) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[os.path.basename(record["path"])] = record
+    return failures, records
+
+
+def make_tree(tmp_path, make_photo):
+    root = tmp_path / "photos"
+    (root / "sub").mkdir(parents=True)
+    make_photo("photos/a.jpg")
+    make_photo("photos/sub/b.png")
+    # claims to be a JPEG but is a GIF
+    make_photo("photos/c.jpg", variant=None, format="GIF")
+    (root / "d.jpg").write_bytes(b"\xff\xd8\xff\xe0 cut short")
+    (root / "notes.txt").write_text("not a photo")
+    return root
+
+
+def test_find_photos(tmp_path, make_photo):
+    root = make_tree(tmp_path, make_photo)
+    names = [os.path.relpath(path, root) for path in batch.find_photos(str(root))]
+    assert names == ["a.jpg", "c.jpg", "d.jpg", os.path.join("sub", "b.png")]
+
+
+def test_batch_run(tmp_path, make_photo, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    root = make_tree(tmp_path, make_photo)
+    failures, records = run_batch(root, tmp_path / "out.jsonl", previews=str(tmp_path / "previews"))
+    assert failures == 2
+    assert records["a.jpg"]["status"] == "ok"
+    assert records["a.jpg"]["backend"] == "pillow"
+    assert "Nikkor" in records["a.jpg"]["caption"]
+    assert records["b.png"]["status"] == "ok"
+    assert records["c.jpg"] == {**records["c.jpg"], "status": "error", "error": "image/gif not supported"}
+    # broken files are reported as such, not as an unsupported format
+    assert records["d.jpg"]["status"] == "error"
+    assert "not supported" not in records["d.jpg"]["error"]
+    assert os.path.exists(tmp_path / "previews" / "a.jpg")
+    assert os.path.exists(tmp_path / "previews" / "sub" / "b.png.jpg")
+    # the bot's preview cache is left alone
+    assert not os.path.exists(tmp_path / preview_cache.CACHE_DIR)
+    assert not os.path.exists(preview_cache.CACHE_DIR)
+
+
+def test_batch_preview_cache(tmp_path, make_photo):
+    make_photo("a.jpg", orientation=6)
+    cache_dir = tmp_path / "cache"
+    run_batch(tmp_path, tmp_path / "out.jsonl", previews=str(tmp_path / "previews"),
+              preview_cache=str(cache_dir))
+    assert any(name.endswith(".jpg") for _, _, names in os.walk(cache_dir) for name in names)
+
+
+def test_batch_resume(tmp_path, make_photo):
+    root = make_tree(tmp_path, make_photo)
+    out = tmp_path / "out.jsonl"
+    run_batch(root, out)
+    with open(out, "a") as f:
+        # a line cut short by a killed run
+        f.write('{"path": "x')
+    failures, records = run_batch(root, out, resume=True)
+    with open(out) as f:
+        lines = f.read().splitlines()
+    # only the two failed files were tried again, after the cut line
+    assert failures == 2
+    assert len(lines) == 4 + 1 + 2
+    assert lines[4] == '{"path": "x'
+    assert records["c.jpg"]["status"] == "error"
+
+
+def test_caption_file_opens_the_photo_once(tmp_path, make_photo, monkeypatch):
+    from PIL import Image
+    from fotobot import metrics
+    from fotobot.exif.styles import Style
+
+    opened = []
+    original_open = Image.open
+
+    def open_image(fp, *args, **kwargs):
+        opened.append(fp)
+        return original_open(fp, *args, **kwargs)
+
+    monkeypatch.setattr(Image, "open", open_image)
+    path = make_photo(orientation=6)
+    record = batch.caption_file((path, Style.DEFAULT.value, str(tmp_path), str(tmp_path / "previews")))
+    assert record["status"] == "ok"
+    assert os.path.exists(record["preview"])
+    assert len(opened) == 1
+    assert metrics.PARSES.values == {("parsed",): 1}
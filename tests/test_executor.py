@@ -0,0 +1,52 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from fotobot.services import executor
+
+
+def die_once(marker: str) -> int:
+    """Kill the worker on the first call, like a decoder crash would."""
+    if not os.path.exists(marker):
+        open(marker, "w").close()
+        os._exit(1)
+    return os.getpid()
+
+
+def always_die() -> None:
+    os._exit(1)
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    created = []
+
+    def create_executor(*args, **kwargs):
+        created.append(ProcessPoolExecutor(max_workers=1))
+        return created[-1]
+
+    monkeypatch.setattr(executor, "create_executor", create_executor)
+    monkeypatch.setattr(executor, "_executor", None)
+    yield created
+    executor.shutdown_executor()
+
+
+def test_broken_pool_is_rebuilt(pools, tmp_path):
+    pid = asyncio.run(executor.run_in_executor(die_once, str(tmp_path / "died")))
+    assert len(pools) == 2
+    assert executor.get_executor() is pools[1]
+    assert pid != os.getpid()
+    # the new pool keeps serving
+    assert asyncio.run(executor.run_in_executor(die_once, str(tmp_path / "died"))) == pid
+
+
+def test_job_is_retried_only_once(pools):
+    with pytest.raises(BrokenProcessPool):
+        asyncio.run(executor.run_in_executor(always_die))
+    assert len(pools) == 2
+    # the next job gets a working pool again
+    assert asyncio.run(executor.run_in_executor(os.getpid)) != os.getpid()
+    assert len(pools) == 3
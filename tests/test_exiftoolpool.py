@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from fotobot.exif import exiftoolpool
+from fotobot.exif.exiftoolpool import ExifToolPool
+
+
+class FakeExifTool:
+    """Stands in for an exiftool process."""
+
+    def __init__(self) -> None:
+        self.helper = object()
+        self.files = 0
+        self.terminated = False
+
+    def start(self) -> None:
+        pass
+
+    def terminate(self) -> None:
+        self.terminated = True
+
+
+@pytest.fixture(autouse=True)
+def fake_exiftool(monkeypatch):
+    monkeypatch.setattr(exiftoolpool, "PooledExifTool", FakeExifTool)
+
+
+def test_checkout_returns_process():
+    pool = ExifToolPool(size=1)
+    with pool.checkout() as first:
+        pass
+    with pool.checkout(timeout=1) as second:
+        assert second is first
+
+
+def test_process_recycled_after_max_files():
+    pool = ExifToolPool(size=1, max_files=2)
+    with pool.checkout(files=2) as first:
+        pass
+    with pool.checkout(timeout=1) as second:
+        assert second is not first
+
+
+def test_process_replaced_after_crash():
+    pool = ExifToolPool(size=1)
+    with pytest.raises(RuntimeError):
+        with pool.checkout() as first:
+            raise RuntimeError("exiftool died")
+    with pool.checkout(timeout=1) as second:
+        assert second is not first
+    assert len(pool._members) == 1
+
+
+def test_cancelled_acheckout_returns_process():
+    async def main():
+        pool = ExifToolPool(size=1)
+        async with pool.acheckout():
+            waiter = asyncio.create_task(pool.acheckout(timeout=5).__aenter__())
+            # the waiter's thread is blocked on the empty pool
+            await asyncio.sleep(0.05)
+            waiter.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiter
+        # the waiter's thread takes the process once released, and gives it back
+        async with pool.acheckout(timeout=1) as helper:
+            assert helper is not None
+        assert pool._idle.qsize() == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_get_metadata_keeps_process_until_done():
+    import threading
+
+    started = threading.Event()
+    finish = threading.Event()
+
+    class SlowHelper:
+        def get_metadata(self, files, params=None):
+            started.set()
+            finish.wait(5)
+            return [{"SourceFile": files}]
+
+    async def main():
+        pool = ExifToolPool(size=1)
+        pool.start()
+        pool._members[0].helper = SlowHelper()
+        task = asyncio.create_task(pool.get_metadata("a.jpg"))
+        await asyncio.to_thread(started.wait, 5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        # exiftool is still answering the cancelled call
+        assert pool._idle.qsize() == 0
+        finish.set()
+        assert await pool.get_metadata("b.jpg") == [{"SourceFile": "b.jpg"}]
+        assert pool._idle.qsize() == 1
+
+    asyncio.run(main())
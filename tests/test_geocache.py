@@ -0,0 +1,132 @@
+import multiprocessing
+import time
+
+import pytest
+
+from fotobot.exif import geocache
+from fotobot.exif.geocache import NOT_FOUND, GeocodeCache, RateLimiter
+
+
+class FakeLocation:
+    def __init__(self, address: str) -> None:
+        self.address = address
+
+
+class FakeGeolocator:
+    def __init__(self, address=None, error=None) -> None:
+        self.address = address
+        self.error = error
+        self.calls = 0
+
+    def reverse(self, point, exactly_one=True):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return FakeLocation(self.address) if self.address else None
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+    monkeypatch.setattr(geocache, "_cache", cache)
+    monkeypatch.setattr(geocache, "_cache_pid", geocache.os.getpid())
+    monkeypatch.setattr(geocache, "_rate_limiter", RateLimiter(0))
+    monkeypatch.setattr(geocache, "_rate_limiter_pid", geocache.os.getpid())
+    yield cache
+    cache.close()
+
+
+def use_geolocator(monkeypatch, geolocator):
+    monkeypatch.setattr(geocache, "_geolocator", geolocator)
+    return geolocator
+
+
+def test_put_get_quantized(cache):
+    cache.put(45.5051, -73.5701, "Montreal")
+    assert cache.get(45.5049, -73.5699) == "Montreal"
+    assert cache.get(45.6, -73.5) is None
+
+
+def test_get_from_disk(tmp_path, cache):
+    cache.put(1.0, 2.0, "Somewhere")
+    reopened = GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+    try:
+        assert reopened.get(1.0, 2.0) == "Somewhere"
+    finally:
+        reopened.close()
+
+
+def test_expired(tmp_path):
+    cache = GeocodeCache(str(tmp_path / "geocode.sqlite3"), ttl=0)
+    cache.put(1.0, 2.0, "Somewhere")
+    assert cache.get(1.0, 2.0) is None
+    cache.close()
+
+
+def test_disk_hits_do_not_commit(tmp_path, cache):
+    cache.put(1.0, 2.0, "Somewhere")
+    reopened = GeocodeCache(str(tmp_path / "geocode.sqlite3"))
+    try:
+        changes = reopened._db.total_changes
+        assert reopened.get(1.0, 2.0) == "Somewhere"
+        assert reopened._db.total_changes == changes
+        assert len(reopened._touched) == 1
+    finally:
+        reopened.close()
+
+
+def test_reverse_geocode_caches_address(cache, monkeypatch):
+    geolocator = use_geolocator(monkeypatch, FakeGeolocator("Montreal"))
+    assert geocache.reverse_geocode(45.5, -73.5) == "Montreal"
+    assert geocache.reverse_geocode(45.5, -73.5) == "Montreal"
+    assert geolocator.calls == 1
+
+
+@pytest.mark.parametrize("geolocator", [FakeGeolocator(), FakeGeolocator(error=ValueError("bad"))])
+def test_reverse_geocode_caches_failures(cache, monkeypatch, geolocator):
+    use_geolocator(monkeypatch, geolocator)
+    assert geocache.reverse_geocode(95.0, 0.0) is None
+    assert geocache.reverse_geocode(95.0, 0.0) is None
+    assert geolocator.calls == 1
+    assert cache.get(95.0, 0.0) == NOT_FOUND
+
+
+def test_failures_expire_after_negative_ttl(cache, monkeypatch):
+    cache.negative_ttl = 0.01
+    geolocator = use_geolocator(monkeypatch, FakeGeolocator())
+    geocache.reverse_geocode(95.0, 0.0)
+    time.sleep(0.02)
+    geocache.reverse_geocode(95.0, 0.0)
+    assert geolocator.calls == 2
+
+
+def wait_twice(limiter, times):
+    for _ in range(2):
+        limiter.wait()
+        times.append(time.monotonic())
+
+
+def test_rate_limiter_shared_by_processes():
+    limiter = RateLimiter(0.1)
+    times = multiprocessing.Manager().list()
+    processes = [multiprocessing.Process(target=wait_twice, args=(limiter, times)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    times = sorted(times)
+    assert len(times) == 6
+    assert times[-1] - times[0] >= 0.5
+    # leeway for the time between a wait returning and the append
+    assert all(b - a >= 0.07 for a, b in zip(times, times[1:]))
+
+
+def test_reverse_geocode_waits_for_rate_limit(cache, monkeypatch):
+    use_geolocator(monkeypatch, FakeGeolocator("Somewhere"))
+    geocache.set_rate_limiter(RateLimiter(0.05))
+    started = time.monotonic()
+    for lat in (1.0, 2.0, 3.0):
+        geocache.reverse_geocode(lat, 0.0)
+    # cache hits don't wait
+    geocache.reverse_geocode(1.0, 0.0)
+    assert 0.1 <= time.monotonic() - started < 0.15
@@ -0,0 +1,58 @@
+from fotobot import metrics
+from fotobot.exif.styles import Style
+from fotobot.services import image_service
+from fotobot.services.executor import create_executor
+
+
+def stage_counts(name: str) -> int:
+    return sum(entry[2] for key, entry in metrics.STAGE_SECONDS.values.items() if key[0] == name)
+
+
+def test_process_photo(make_photo):
+    result = image_service.process_photo(make_photo(), Style.DEFAULT.value)
+    assert result.mimetype == "image/jpeg"
+    assert result.backend == "pillow"
+    assert "Lens: Nikkor ℤ 50mm f/1.8 S" in result.caption
+    assert result.photo is not None
+    # run in this process, nothing to hand back
+    assert result.metrics is None
+
+
+def test_parse_stage_timed_once(make_photo):
+    image_service.process_photo(make_photo(), Style.DEFAULT.value)
+    assert stage_counts("parse") == 1
+    assert stage_counts("mime") == 1
+    assert stage_counts("caption") == 1
+
+
+def test_parse_counts_come_back_from_pool(make_photo):
+    path = make_photo()
+    executor = create_executor("process", 1)
+    try:
+        result = executor.submit(image_service.process_photo, path, Style.DEFAULT.value).result()
+    finally:
+        executor.shutdown()
+    assert result.metrics["fotobot_parse_total"] == {("parsed",): 1}
+    assert metrics.PARSES.values == {}
+    metrics.merge(result.metrics)
+    assert metrics.PARSES.values == {("parsed",): 1}
+    assert stage_counts("parse") == 1
+
+
+def test_forked_worker_does_not_send_back_parent_metrics(make_photo):
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    from fotobot.services.executor import init_worker
+
+    path = make_photo()
+    metrics.ERRORS.inc(kind="busy")
+    metrics.CACHE_EVENTS.inc(cache="result", result="miss")
+    executor = ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("fork"), initializer=init_worker)
+    try:
+        result = executor.submit(image_service.process_photo, path, Style.DEFAULT.value).result()
+    finally:
+        executor.shutdown()
+    assert not result.metrics["fotobot_errors_total"]
+    assert not result.metrics["fotobot_cache_total"]
+    metrics.merge(result.metrics)
+    assert metrics.ERRORS.values == {("busy",): 1}
@@ -0,0 +1,34 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks.importtime import BUDGET_MS, LAZY, MODULES, check
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def imported_modules(module: str) -> set:
+    """Names of the modules a fresh interpreter loads to import ``module``."""
+    # only the repository on the path, so a config.py elsewhere can't be picked up
+    env = {**os.environ, "PYTHONPATH": ROOT}
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=ROOT, env=env)
+    assert proc.returncode == 0, proc.stderr
+    return {line.rsplit("|", 1)[1].strip() for line in proc.stderr.splitlines()
+            if line.startswith("import time:") and "|" in line}
+
+
+@pytest.mark.parametrize("module", ["fotobot.batch", "fotobot.services.processing"])
+def test_offline_modules_stay_away_from_the_bot(module):
+    modules = imported_modules(module)
+    assert module in modules
+    assert not {"telegram", "config"} & modules
+    assert not set(LAZY) & modules
+
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import_time_budget(module):
+    # best of three fresh interpreters, a single run is too noisy on a busy machine
+    assert check(module, BUDGET_MS, repeat=3) == []
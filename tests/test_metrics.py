@@ -0,0 +1,46 @@
+from fotobot import metrics
+
+
+def test_stages_are_timed_only_inside_track_stages():
+    with metrics.stage("resize"):
+        pass
+    with metrics.track_stages() as timer:
+        with metrics.stage("resize"):
+            pass
+        with metrics.stage("encode"):
+            pass
+    assert [name for name, _ in timer.timings] == ["resize", "encode"]
+    timer.observe(backend="pillow", mimetype="image/jpeg", style="default")
+    assert metrics.STAGE_SECONDS.values[("encode", "pillow", "image/jpeg", "default")][2] == 1
+
+
+def test_drain_and_merge_across_processes():
+    metrics.ERRORS.inc(kind="busy")
+    metrics.STAGE_SECONDS.observe(0.02, stage="parse")
+    # what a pool worker returns next to its result
+    drained = metrics.drain()
+    assert metrics.ERRORS.values == {}
+    metrics.ERRORS.inc(kind="busy")
+    metrics.merge(drained)
+    metrics.merge(drained)
+    assert metrics.ERRORS.values == {("busy",): 3}
+    counts, total, count = metrics.STAGE_SECONDS.values[("parse", "", "", "")]
+    assert (count, sum(counts)) == (2, 2)
+    assert abs(total - 0.04) < 1e-9
+
+
+def test_render():
+    metrics.PARSES.inc(result="parsed")
+    metrics.STAGE_SECONDS.observe(0.02, stage="parse")
+    metrics.register_collector(lambda: [("fotobot_test", "gauge", "A test", [({"queue": 'a"b'}, 1)])])
+    try:
+        text = metrics.render()
+    finally:
+        metrics.COLLECTORS.pop()
+    lines = text.splitlines()
+    assert "# TYPE fotobot_parse_total counter" in lines
+    assert 'fotobot_parse_total{result="parsed"} 1' in lines
+    assert 'fotobot_stage_seconds_bucket{stage="parse",backend="",mimetype="",style="",le="0.01"} 0' in lines
+    assert 'fotobot_stage_seconds_bucket{stage="parse",backend="",mimetype="",style="",le="0.025"} 1' in lines
+    assert 'fotobot_stage_seconds_bucket{stage="parse",backend="",mimetype="",style="",le="+Inf"} 1' in lines
+    assert 'fotobot_test{queue="a\\"b"} 1' in lines
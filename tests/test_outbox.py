@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from fotobot.services.outbox import PRIORITY_ERROR, PRIORITY_PHOTO, PRIORITY_TEXT, Outbox, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    assert bucket.delay(now) == 0
+    bucket.take()
+    bucket.take()
+    assert bucket.delay(now) == pytest.approx(0.5)
+    assert bucket.delay(now + 0.5) == 0
+    # never refills beyond its capacity
+    assert bucket.delay(now + 100) == 0 and bucket.tokens == 2
+
+
+def test_lower_priority_value_sent_first():
+    async def main():
+        outbox = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+        sent = []
+
+        async def send(name):
+            sent.append(name)
+            return name
+
+        jobs = [(PRIORITY_PHOTO, "photo1"), (PRIORITY_TEXT, "text"), (PRIORITY_PHOTO, "photo2"),
+                (PRIORITY_ERROR, "error")]
+        results = await asyncio.gather(*(outbox.submit(1, priority, send, name) for priority, name in jobs))
+        await outbox.stop()
+        assert results == ["photo1", "text", "photo2", "error"]
+        assert sent == ["error", "text", "photo1", "photo2"]
+        assert outbox.stats()["sent"] == {PRIORITY_PHOTO: 2, PRIORITY_TEXT: 1, PRIORITY_ERROR: 1}
+
+    asyncio.run(main())
+
+
+def test_chat_rate_does_not_hold_back_other_chats():
+    async def main():
+        outbox = Outbox(global_rate=1000, chat_rate=10, chat_burst=1)
+        sent = {}
+
+        async def send(name):
+            sent[name] = time.monotonic()
+
+        started = time.monotonic()
+        await asyncio.gather(*(outbox.submit(1, PRIORITY_TEXT, send, f"a{i}") for i in range(3)),
+                             outbox.submit(2, PRIORITY_TEXT, send, "b0"))
+        await outbox.stop()
+        # chat 1 gets one message per 0.1s, chat 2 goes out right away
+        assert sent["b0"] - started < 0.05
+        assert sent["a2"] - sent["a0"] >= 0.15
+
+    asyncio.run(main())
+
+
+def test_errors_reach_the_caller():
+    async def main():
+        outbox = Outbox()
+
+        async def send():
+            raise ValueError("refused")
+
+        with pytest.raises(ValueError, match="refused"):
+            await outbox.submit(1, PRIORITY_TEXT, send)
+        await outbox.stop()
+
+    asyncio.run(main())
+
+
+def test_stop_cancels_queued_jobs():
+    async def main():
+        outbox = Outbox(global_rate=1000, chat_rate=0.01, chat_burst=1)
+
+        async def send():
+            return "ok"
+
+        first = asyncio.create_task(outbox.submit(1, PRIORITY_TEXT, send))
+        second = asyncio.create_task(outbox.submit(1, PRIORITY_TEXT, send))
+        assert await first == "ok"
+        # the chat's bucket is empty for 100s
+        await asyncio.sleep(0.01)
+        assert outbox.depth() == {PRIORITY_TEXT: 1}
+        await outbox.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await second
+
+    asyncio.run(main())
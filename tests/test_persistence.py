@@ -0,0 +1,54 @@
+import asyncio
+
+from fotobot.bot.persistence import SQLitePersistence, decode_key, encode_key
+
+
+def test_key_round_trip():
+    for key in [(1,), (-100123456789, 42), (1, 2, 3)]:
+        assert decode_key(encode_key(key)) == key
+
+
+def test_conversations_survive_a_restart(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def first_run():
+        persistence = SQLitePersistence(path)
+        await persistence.update_conversation("style", (1, 10), 0)
+        await persistence.update_conversation("style", (2, 20), 1)
+        await persistence.update_conversation("style", (3, 30), 1)
+        await persistence.update_conversation("other", (1, 10), 5)
+        await persistence.flush()
+
+    async def second_run():
+        persistence = SQLitePersistence(path)
+        assert await persistence.get_conversations("style") == {(1, 10): 0, (2, 20): 1, (3, 30): 1}
+        await persistence.update_conversation("style", (2, 20), None)
+        await persistence.update_conversation("style", (1, 10), 2)
+        await persistence.flush()
+
+    async def third_run():
+        persistence = SQLitePersistence(path)
+        assert await persistence.get_conversations("style") == {(1, 10): 2, (3, 30): 1}
+        assert await persistence.get_conversations("other") == {(1, 10): 5}
+        await persistence.flush()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+    asyncio.run(third_run())
+
+
+def test_pending_changes_win_over_the_database(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+
+    async def main():
+        persistence = SQLitePersistence(path)
+        await persistence.update_conversation("style", (1, 10), 0)
+        await persistence.flush()
+        persistence = SQLitePersistence(path)
+        # changes handed over but not written yet
+        persistence._pending[("style", (1, 10))] = None
+        persistence._pending[("style", (2, 20))] = 3
+        assert await persistence.get_conversations("style") == {(2, 20): 3}
+        await persistence.flush()
+
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from fotobot.services import photo_handler as ph
+from fotobot.services.admission import BusyError
+from fotobot.services.processing import UnsupportedFormatError
+
+
+def make_update(file_size=1000, mime_type="image/jpeg"):
+    document = SimpleNamespace(file_size=file_size, mime_type=mime_type)
+    return SimpleNamespace(message=SimpleNamespace(effective_attachment=document))
+
+
+def test_validate_upload():
+    ph.validate_upload(make_update())
+    ph.validate_upload(make_update(file_size=None, mime_type=None))
+    with pytest.raises(IOError):
+        ph.validate_upload(make_update(file_size=ph.MAX_FILE_SIZE + 1))
+    with pytest.raises(UnsupportedFormatError):
+        ph.validate_upload(make_update(mime_type="image/gif"))
+
+
+def test_download_image_writes_off_the_loop(tmp_path, monkeypatch):
+    writers = []
+
+    async def download(update):
+        return b"\xff\xd8\xff data"
+
+    def write_file(photo_path, data):
+        writers.append(threading.current_thread())
+        original_write_file(photo_path, data)
+
+    original_write_file = ph.write_file
+    monkeypatch.setattr(ph, "download_image_to_memory", download)
+    monkeypatch.setattr(ph, "write_file", write_file)
+    path = tmp_path / "upload"
+    asyncio.run(ph.download_image(make_update(), str(path)))
+    assert path.read_bytes() == b"\xff\xd8\xff data"
+    assert writers and writers[0] is not threading.main_thread()
+
+
+@pytest.mark.parametrize("error, kind", [
+    (IOError("download"), "download"),
+    (UnsupportedFormatError("image/gif"), "mimetype"),
+    (UnsupportedFormatError(), "mimetype"),
+    # a bug, not an unsupported upload
+    (TypeError("unsupported operand"), "parse"),
+    (BusyError(1), "busy"),
+    (ValueError("bad exif"), "parse"),
+])
+def test_get_error_reply(error, kind):
+    assert ph.get_error_reply(error)[0] == kind
+
+
+def test_album_failure_is_replied_to(monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+    from fotobot import metrics
+    from fotobot.services.album import AlbumCollector
+
+    replies = []
+
+    async def process_album(updates, style):
+        raise BrokenProcessPool("worker died")
+
+    async def reply_text(update, text, parse_mode, **kwargs):
+        replies.append((update, text))
+
+    collector = AlbumCollector(wait=0)
+    monkeypatch.setattr(ph, "get_album_collector", lambda: collector)
+    monkeypatch.setattr(ph.image_service, "process_album", process_album)
+    monkeypatch.setattr(ph, "reply_text", reply_text)
+    update = SimpleNamespace(message=SimpleNamespace(media_group_id="g", message_id=1))
+    collector.add(update)
+    asyncio.run(ph.album_handler(update, 0))
+    assert replies == [(update, "Cannot parse EXIF data!")]
+    assert metrics.ERRORS.values == {("parse",): 1}
@@ -0,0 +1,66 @@
+import os
+
+from fotobot.services.preview_cache import PreviewCache
+
+
+def test_key_depends_on_content_and_settings():
+    key = PreviewCache.key("digest", 1, "quality", 95)
+    assert key == PreviewCache.key("digest", 1, "quality", 95)
+    assert key != PreviewCache.key("other", 1, "quality", 95)
+    assert key != PreviewCache.key("digest", 1, "speed", 95)
+
+
+def test_put_get(tmp_path):
+    cache = PreviewCache(str(tmp_path), max_bytes=1000)
+    key = PreviewCache.key("digest")
+    assert cache.get(key) is None
+    cache.put(key, b"jpeg")
+    assert cache.get(key) == b"jpeg"
+    # visible to other processes sharing the directory
+    assert PreviewCache(str(tmp_path)).get(key) == b"jpeg"
+    assert not [name for _, _, names in os.walk(tmp_path) for name in names if name.endswith(".tmp")]
+
+
+def test_oversized_previews_are_not_stored(tmp_path):
+    cache = PreviewCache(str(tmp_path), max_bytes=10)
+    cache.put("ab" * 32, b"x" * 11)
+    assert cache.get("ab" * 32) is None
+
+
+def test_trim_removes_least_recently_used(tmp_path):
+    cache = PreviewCache(str(tmp_path), max_bytes=300)
+    keys = [PreviewCache.key(str(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(key, b"x" * 100)
+        os.utime(cache.get_path(key), (i, i))
+    # a hit makes the oldest entry the most recent one
+    assert cache.get(keys[0]) is not None
+    cache.put(PreviewCache.key("3"), b"x" * 100)
+    # trimmed below 90% of the budget, oldest first
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[2]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(PreviewCache.key("3")) is not None
+    assert sum(size for _, size, _ in cache.scan()) == 200
+
+
+def test_cache_errors_do_not_fail_the_preview(make_photo):
+    from fotobot.services import processing
+    from fotobot.services.preview_cache import get_preview_cache, set_preview_cache
+
+    class BrokenCache(PreviewCache):
+        def get(self, key):
+            raise PermissionError("read-only")
+
+        def put(self, key, data):
+            raise OSError(28, "No space left on device")
+
+    # rotated, so it is rendered instead of passed through
+    path = make_photo(size=(64, 48), orientation=6)
+    cache = get_preview_cache()
+    set_preview_cache(BrokenCache("unused"))
+    try:
+        data = processing.render_photo(path, "caption", 6)
+    finally:
+        set_preview_cache(cache)
+    assert data[:2] == b"\xff\xd8"
@@ -0,0 +1,90 @@
+import io
+
+import pytest
+from PIL import Image
+
+from fotobot.services import processing
+
+from conftest import open_size
+
+
+def noisy(size=(256, 256)):
+    """An image that does not compress well."""
+    return Image.effect_noise(size, 80).convert("RGB")
+
+
+def quality_of(data: bytes) -> int:
+    with Image.open(io.BytesIO(data)) as img:
+        # the luminance table scales with the quality
+        return img.quantization[0][0]
+
+
+def test_img_to_bytes_keeps_quality_when_it_fits():
+    img = noisy()
+    data = processing.img_to_bytes(img, max_bytes=10 * 1000 * 1000, quality=95)
+    assert data == processing.encode_jpeg(img, 95)
+
+
+def test_img_to_bytes_lowers_quality_to_fit():
+    img = noisy()
+    full = processing.encode_jpeg(img, 95)
+    max_bytes = len(full) // 2
+    data = processing.img_to_bytes(img, max_bytes=max_bytes, quality=95)
+    assert len(data) <= max_bytes
+    assert quality_of(data) > quality_of(full)
+    assert open_size(data) == img.size
+
+
+def test_img_to_bytes_falls_back_to_min_quality():
+    img = noisy()
+    data = processing.img_to_bytes(img, max_bytes=100, quality=95)
+    assert data == processing.encode_jpeg(img, processing.JPEG_MIN_QUALITY)
+
+
+@pytest.mark.parametrize("mode", ["RGBA", "LA", "P", "I;16", "CMYK"])
+def test_img_to_bytes_normalizes_mode(mode):
+    img = Image.new(mode, (32, 24)) if mode == "I;16" else Image.new("RGB", (32, 24), "red").convert(mode)
+    data = processing.img_to_bytes(img)
+    with Image.open(io.BytesIO(data)) as out:
+        assert out.format == "JPEG"
+        assert out.mode in ("RGB", "L")
+        assert out.size == (32, 24)
+
+
+def test_decoded_size_counts_source_and_target(make_photo):
+    path = make_photo(size=(300, 200))
+    assert processing.get_decoded_size(path) == 300 * 200 * 4 * 2
+    path = make_photo("big.jpg", size=(5120, 10))
+    # speed mode caps the preview at PREVIEW_MAX_SIDE
+    assert processing.get_decoded_size(path, "speed") == 5120 * 10 * 4 + 2560 * 5 * 4
+
+
+def test_passthrough_only_for_plain_jpegs(make_photo):
+    path = make_photo(size=(64, 48))
+    data = processing.get_passthrough(path, 1)
+    assert data is not None
+    assert open_size(data) == (64, 48)
+    with Image.open(io.BytesIO(data)) as img:
+        # the location never leaves with the passed through bytes
+        assert processing.ExifTags.Base.GPSInfo not in img.getexif()
+    assert processing.get_passthrough(path, 6) is None
+    assert processing.get_passthrough(make_photo("photo.png", variant=None, format="PNG"), 1) is None
+    assert processing.get_passthrough(make_photo("progressive.jpg", progressive=True), 1) is None
+
+
+@pytest.mark.parametrize("orientation, size", [(1, (64, 48)), (3, (64, 48)), (6, (48, 64)), (8, (48, 64))])
+def test_render_applies_orientation(make_photo, orientation, size):
+    path = make_photo(size=(64, 48), orientation=orientation)
+    assert open_size(processing.render_photo(path, "caption", orientation)) == size
+
+
+def test_render_does_not_rotate_heif_twice(tmp_path):
+    processing.register_plugins()
+    exif = Image.Exif()
+    exif[processing.ExifTags.Base.Orientation] = 6
+    path = str(tmp_path / "photo.heic")
+    Image.new("RGB", (64, 48), "red").save(path, format="HEIF", exif=exif.tobytes())
+    with Image.open(path) as img:
+        # upright after decoding already
+        assert img.size == (48, 64)
+    assert open_size(processing.render_photo(path, "caption", 6)) == (48, 64)
@@ -0,0 +1,121 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from fotobot.services import result_cache
+from fotobot.services.result_cache import ResultCache
+
+Result = namedtuple("Result", "caption file_id")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_least_recently_used_is_evicted():
+    cache = ResultCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c"), len(cache)) == (1, 3, 2)
+
+
+def test_entries_expire(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("a", 1)
+    clock[0] += 9
+    assert cache.get("a") == 1
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_update_keeps_the_age(clock):
+    cache = ResultCache(ttl=10)
+    cache.put("a", Result("caption", None))
+    clock[0] += 5
+    cache.update("a", file_id="abc")
+    cache.update("missing", file_id="abc")
+    assert cache.get("a") == Result("caption", "abc")
+    clock[0] += 5
+    assert cache.get("a") is None
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        cache = ResultCache()
+        calls = 0
+
+        async def work(value):
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(*(cache.run_once("a", work, "x") for _ in range(3)))
+        assert calls == 1
+        assert sorted(results, key=lambda r: r[1]) == [("x", False), ("x", True), ("x", True)]
+        # the next call after the first one finished runs again
+        assert await cache.run_once("a", work, "y") == ("y", False)
+        assert calls == 2
+
+    asyncio.run(main())
+
+
+def test_shared_errors_reach_every_caller():
+    async def main():
+        cache = ResultCache()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("broken")
+
+        results = await asyncio.gather(*(cache.run_once("a", fail) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(r, ValueError) for r in results)
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_does_not_cancel_the_call():
+    async def main():
+        cache = ResultCache()
+
+        async def work():
+            await asyncio.sleep(0.02)
+            return "done"
+
+        first = asyncio.create_task(cache.run_once("a", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.run_once("a", work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        assert await first == ("done", False)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+
+
+def test_cancelled_call_cancels_its_waiters():
+    async def main():
+        cache = ResultCache()
+
+        async def work():
+            await asyncio.sleep(1)
+
+        first = asyncio.create_task(cache.run_once("a", work))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.run_once("a", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert cache._in_flight == {}
+
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+import telegram
+
+from fotobot.services.helper import RetryPolicy
+
+
+class Flaky:
+    """Raises the given errors one per call, then returns "ok"."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_retries_network_errors():
+    func = Flaky(telegram.error.NetworkError("down"), telegram.error.TimedOut())
+    policy = RetryPolicy(retries=3, base_delay=0.001)
+    assert asyncio.run(policy.run(func)) == "ok"
+    assert func.calls == 3
+
+
+def test_gives_up_after_retries():
+    func = Flaky(*[telegram.error.NetworkError("down")] * 5)
+    policy = RetryPolicy(retries=2, base_delay=0.001)
+    with pytest.raises(telegram.error.NetworkError):
+        asyncio.run(policy.run(func))
+    assert func.calls == 3
+
+
+def test_bad_request_is_not_retried():
+    func = Flaky(telegram.error.BadRequest("wrong"))
+    with pytest.raises(telegram.error.BadRequest):
+        asyncio.run(RetryPolicy(base_delay=0.001).run(func))
+    assert func.calls == 1
+
+
+def test_other_errors_are_not_retried():
+    func = Flaky(ValueError())
+    with pytest.raises(ValueError):
+        asyncio.run(RetryPolicy(base_delay=0.001).run(func))
+    assert func.calls == 1
+
+
+def test_delay_backs_off_and_honours_retry_after():
+    policy = RetryPolicy(base_delay=0.1, max_delay=0.5, jitter=False)
+    error = telegram.error.NetworkError("down")
+    assert [policy.get_delay(attempt, error) for attempt in range(4)] == [0.1, 0.2, 0.4, 0.5]
+    assert policy.get_delay(0, telegram.error.RetryAfter(7)) == 7.0
+    jittered = RetryPolicy(base_delay=0.1, max_delay=0.5)
+    assert all(0 <= jittered.get_delay(3, error) <= 0.5 for _ in range(20))
+
+
+def test_no_retry_past_the_deadline():
+    # waiting out the hint would end after the deadline, fail right away
+    func = Flaky(telegram.error.RetryAfter(60))
+    with pytest.raises(telegram.error.RetryAfter):
+        asyncio.run(RetryPolicy(deadline=1).run(func))
+    assert func.calls == 1
+
+
+def test_decorator():
+    func = Flaky(telegram.error.NetworkError("down"))
+    wrapped = RetryPolicy(base_delay=0.001)(func)
+    assert asyncio.run(wrapped()) == "ok"
+    assert func.calls == 2
@@ -0,0 +1,88 @@
+import asyncio
+
+from fotobot.bot.update_processor import ChatOrderedUpdateProcessor
+
+
+class ChatProcessor(ChatOrderedUpdateProcessor):
+    """Uses the update itself, a ``(chat, name)`` tuple, as its chat id."""
+
+    @staticmethod
+    def get_chat_id(update):
+        return update[0]
+
+
+def test_idle_chat_not_blocked_by_busy_chat():
+    async def main():
+        processor = ChatProcessor(2)
+        release = asyncio.Event()
+        order = []
+
+        async def handle(name, wait=False):
+            if wait:
+                await release.wait()
+            order.append(name)
+
+        tasks = [asyncio.create_task(processor.process_update(("a", "a0"), handle("a0", wait=True)))]
+        for name in ("a1", "a2"):
+            tasks.append(asyncio.create_task(processor.process_update(("a", name), handle(name))))
+        tasks.append(asyncio.create_task(processor.process_update(("b", "b0"), handle("b0"))))
+        # b0 must finish while a0 still holds chat a
+        await asyncio.wait_for(tasks[-1], 1)
+        assert order == ["b0"]
+        release.set()
+        await asyncio.gather(*tasks)
+        assert order == ["b0", "a0", "a1", "a2"]
+
+    asyncio.run(main())
+
+
+def test_updates_of_one_chat_stay_in_order():
+    async def main():
+        processor = ChatProcessor(4)
+        order = []
+
+        async def handle(name, delay):
+            await asyncio.sleep(delay)
+            order.append(name)
+
+        # later updates are faster and would overtake without the chat lock
+        await asyncio.gather(*(
+            processor.process_update(("a", i), handle(i, 0.01 * (5 - i))) for i in range(5)
+        ))
+        assert order == list(range(5))
+
+    asyncio.run(main())
+
+
+def test_concurrency_limit():
+    async def main():
+        processor = ChatProcessor(2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update((chat, 0), handle()) for chat in range(6)))
+        assert peak == 2
+        assert processor.max_concurrent_updates == 2
+
+    asyncio.run(main())
+
+
+def test_updates_without_chat():
+    async def main():
+        processor = ChatOrderedUpdateProcessor(2)
+        order = []
+
+        async def handle(name):
+            order.append(name)
+
+        await processor.process_update(object(), handle("x"))
+        assert order == ["x"]
+        assert processor._chats == {}
+
+    asyncio.run(main())
@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from fotobot.bot.webhook import SECRET_TOKEN_HEADER, build_webhook_app
+
+SECRET = "s3cret"
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 2,
+        "date": 0,
+        "chat": {"id": 3, "type": "private"},
+        "text": "hi",
+    },
+}
+
+
+def post(body, secret=SECRET, **kwargs):
+    """POST ``body`` to a fresh webhook app, return the status and the queued updates."""
+    async def main():
+        application = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        client = TestClient(TestServer(build_webhook_app(application, "/hook", SECRET)))
+        await client.start_server()
+        try:
+            headers = {SECRET_TOKEN_HEADER: secret} if secret is not None else {}
+            response = await client.post("/hook", headers=headers, **kwargs, **body)
+            status = response.status
+        finally:
+            await client.close()
+        queued = []
+        while not application.update_queue.empty():
+            queued.append(application.update_queue.get_nowait())
+        return status, queued
+
+    return asyncio.run(main())
+
+
+def test_update_is_queued():
+    status, queued = post({"json": UPDATE})
+    assert status == 200
+    assert [update.update_id for update in queued] == [1]
+
+
+def test_wrong_secret():
+    status, queued = post({"json": UPDATE}, secret="wrong")
+    assert status == 403
+    assert queued == []
+
+
+def test_missing_secret():
+    status, queued = post({"json": UPDATE}, secret=None)
+    assert status == 403
+
+
+def test_invalid_json():
+    status, queued = post({"data": b"{not json"})
+    assert status == 400
+
+
+def test_json_not_an_object():
+    for body in ([UPDATE], "update", 42, None):
+        status, queued = post({"json": body})
+        assert status == 400, body
+        assert queued == []